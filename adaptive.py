@@ -0,0 +1,153 @@
+#!/bin/python3
+# Copyright (c) Open Enclave SDK contributors.
+# Licensed under the MIT License
+
+import argparse
+import math
+import statistics
+
+import fioresult
+import jobspec
+import resultstore
+
+# Metrics whose medians have to be known precisely enough.
+metrics = ('IOPS', 'BW (MB/s)')
+
+def sample(result):
+    """Return {metric: total over ops and jobs} of one result, or None."""
+    varying = fioresult.metrics(resultstore.output(result))
+    if not varying['op']:
+        return None
+    return {m: sum(v or 0 for v in varying[m]) for m in metrics}
+
+def binomial_cdf(k, n):
+    """P(X <= k) for X ~ Binomial(n, 1/2)."""
+    return sum(math.comb(n, i) for i in range(k + 1)) / 2.0 ** n
+
+def median_interval(values, confidence):
+    """Return a distribution-free confidence interval (lo, hi) of the median.
+
+    The interval is between the kth smallest and kth largest value, with
+    the largest k whose coverage is at least confidence. Returns None when
+    there are too few values for any interval of that confidence.
+    """
+    values = sorted(values)
+    n = len(values)
+    k = 0
+    while k < n // 2 and 2 * binomial_cdf(k, n) <= 1 - confidence:
+        k += 1
+    if not k:
+        return None
+    return values[k - 1], values[n - k]
+
+def relative_width(values, confidence):
+    """Return the width of the median's interval relative to the median, or None."""
+    interval = median_interval(values, confidence)
+    if not interval:
+        return None
+    median = statistics.median(values)
+    if not median:
+        return 0.0
+    return (interval[1] - interval[0]) / median
+
+def min_samples(confidence):
+    """Return the fewest values that have a median interval at confidence."""
+    n = 1
+    while 2 * binomial_cdf(0, n) > 1 - confidence:
+        n += 1
+    return n
+
+
+class Controller:
+    """Decides how often each configuration is run.
+
+    A configuration (a job without its `+repeat=N` token) is run until the
+    confidence interval of the median of each metric is narrower than
+    `width` times the median, or `max_repeats` runs have results. Results
+    of the configuration on every replica cluster count, including those
+    of runs before this mode was used.
+    """
+
+    def __init__(self, width=0.05, confidence=0.9, max_repeats=10):
+        self.width = width
+        self.confidence = confidence
+        self.max_repeats = max_repeats
+        self.min_repeats = min(min_samples(confidence), max_repeats)
+
+    def config(self, job):
+        """Return the key of job's configuration, the same for all its runs."""
+        return jobspec.with_repeat(job, 1).digest
+
+    def initial(self, job):
+        """Return the runs of job to start with."""
+        return [jobspec.with_repeat(job, r) for r in range(1, self.min_repeats + 1)]
+
+    def samples(self, job, benches):
+        """Return the samples of job's configuration in the caches of benches."""
+        samples = []
+        for r in range(1, self.max_repeats + 1):
+            run = jobspec.with_repeat(job, r)
+            for bench in benches:
+                result = bench.cache_lookup(run)
+                s = sample(result) if result else None
+                if s:
+                    samples.append(s)
+        return samples
+
+    def widths(self, samples):
+        return {m: relative_width([s[m] for s in samples], self.confidence) for m in metrics}
+
+    def converged(self, samples):
+        widths = self.widths(samples)
+        return all(w is not None and w <= self.width for w in widths.values())
+
+    def more(self, jobs, benches, parallel=1):
+        """Return the next runs of a configuration, or [] when it has enough.
+
+        jobs are the runs planned so far; up to parallel runs are returned
+        so that several replicas can work on it at once.
+        """
+        job = jobs[0]
+        last = max(j.repeat for j in jobs)
+        samples = self.samples(job, benches)
+        if len(samples) >= self.max_repeats or self.converged(samples):
+            return []
+        count = min(parallel, self.max_repeats - len(samples), self.max_repeats - last)
+        return [jobspec.with_repeat(job, last + i) for i in range(1, count + 1)]
+
+    def estimate(self, job, cached):
+        """Return the (fewest, most) runs of job's configuration still to do.
+
+        cached is the set of keys of the results on all replicas.
+        """
+        done = sum(1 for r in range(1, self.max_repeats + 1)
+                   if jobspec.with_repeat(job, r).digest in cached)
+        return max(0, self.min_repeats - done), max(0, self.max_repeats - done)
+
+    def describe(self, jobs, benches):
+        samples = self.samples(jobs[0], benches)
+        widths = self.widths(samples)
+        return '%d runs, %s' % (len(samples), ', '.join(
+            '%s %s' % (m, '-' if w is None else '+-%.1f%%' % (50 * w)) for m, w in widths.items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Print the confidence interval of the median IOPS/BW of every configuration')
+    parser.add_argument('folders', type=str, nargs='+', help='Result folders of replica clusters')
+    parser.add_argument('--confidence', type=float, default=0.9)
+
+    args = parser.parse_args()
+    configs = {}
+    for folder in args.folders:
+        store = resultstore.ResultStore(folder)
+        for job, result in store.items():
+            s = sample(result)
+            if s:
+                spec = jobspec.with_repeat(job, 1)
+                configs.setdefault(spec.digest, (spec, []))[1].append(s)
+    for spec, samples in sorted(configs.values(), key=lambda c: str(c[0])):
+        widths = {m: relative_width([s[m] for s in samples], args.confidence) for m in metrics}
+        print('%3d  %s  %s' % (len(samples), '  '.join(
+            '%s %s' % (m, '-' if w is None else '+-%.1f%%' % (50 * w))
+            for m, w in widths.items()), spec))
@@ -3,13 +3,21 @@
 # Licensed under the MIT License
 
 import argparse
+import json
 import os
-import pickle
 import re
-import subprocess
 import sys
-import traceback
 import threading
+import uuid
+
+import engine
+import fioresult
+import fioserver
+import iologs
+import jobspec
+import kataconfig
+import kube
+import resultstore
 
 class Benchmark:
     lock = threading.Lock()
@@ -18,18 +26,23 @@ class Benchmark:
 apiVersion: batch/v1
 kind: Job
 metadata:
-  name: fio-test
+  name: %(name)s
+  labels:
+    app: fio-test
 spec:
   template:
     metadata:
       labels:
         app: fio-test
+        fio-job: %(name)s
     spec:
       %(runtime_class)s
+      %(node_selector)s
       containers:
         - name: fio-test
           image: fangluguopub.azurecr.io/ubuntu-debug
-          command: ["/docker-entrypoint.sh", "fio"]
+          command: %(command)s
+          args: %(args)s
           imagePullPolicy: IfNotPresent
           env:
             - name: DBENCH_MOUNTPOINT
@@ -74,7 +87,8 @@ spec:
       restartPolicy: "Never"
   backoffLimit: 0
 """
-    def __init__(self, folder, cluster, resource_group, subscription, runtime_class, update_cache):
+    def __init__(self, folder, cluster, resource_group, subscription, runtime_class, update_cache,
+                 tracker=None, fio_server=False, telemetry=None, settings=None):
         self.folder = folder
         self.cluster = cluster
         self.resource_group = resource_group
@@ -82,45 +96,29 @@ spec:
         self.runtime_class = runtime_class
         self.update_cache = update_cache
         self.cache_file = os.path.join(folder, 'cache.pickle')
-        self.cache = None
-        self.normalized_cache = None
+        self.store = None
+        self.tracker = tracker
+        # Whether prepare() started the tracker, so close() stops it.
+        self.owns_tracker = False
+        self.servers = fioserver.FioServers(cluster, runtime_class) if fio_server else None
+        self.telemetry = telemetry
+        # Kata settings swept like fio options, e.g. [('virtio_fs_cache', 'none', 'auto')].
+        self.settings = settings if runtime_class else None
+        # Threads waiting for the pods of finished Jobs to be deleted.
+        self.deleting = []
 
     def gen_jobs(self, options, cmd):
-        jobs = []
-        def gen(options, cmd):
-            if len(options) == 0:
-                jobs.append(cmd)
-            else:
-                opt, options = options[0], options[1:]
-                name = opt[0]
-                values = opt[1:]
-
-                if len(values) == 1 and isinstance(values[0], tuple):
-                    values = values[0]
-
-                if len(values) > 0:
-                    cmd += ' --' + name + '='
-
-                    for v in values:
-                        gen(options, cmd + str(v))
-                else:
-                    gen(options, cmd + ' --' + name)
-
-        gen(options, cmd)
-        return jobs
-
-    def normalize(self, job):
-        return ' '.join(sorted(job.split(' ')))
+        return jobspec.expand(options, cmd)
 
     def load_cache(self):
-        self.cache = {}
-        self.normalized_cache = {}
-        if os.path.isfile(self.cache_file):
-            with open(self.cache_file, 'rb') as f:
-                cache = pickle.load(f)
-                for job in list(cache.keys()):
-                    njob = self.normalize(job)
-                    self.normalized_cache[njob] = cache[job]
+        self.store = resultstore.ResultStore(self.folder, writer=True)
+        # Import a legacy cache.pickle unless the store is already newer.
+        if (os.path.isfile(self.cache_file) and
+                (not os.path.isfile(self.store.path) or
+                 os.path.getmtime(self.cache_file) > os.path.getmtime(self.store.path))):
+            n = self.store.import_pickle(self.cache_file)
+            if n:
+                print("%s: Imported %d results from %s." % (self.cluster, n, self.cache_file))
         print("%s: Loaded cached results." % self.cluster)
         if self.update_cache:
             print("%s: Updating cache with new results." % self.cluster)
@@ -130,30 +128,19 @@ spec:
         if self.update_cache:
             return None
 
-        if job in self.cache:
-            return self.cache[job]
-        njob = self.normalize(job)
-        if njob in self.normalized_cache:
-            return self.normalized_cache[njob]
+        try:
+            return self.store.get(job)
+        except IOError as e:
+            # Run the job again; its new record supersedes the corrupt one.
+            print(e)
+            return None
 
     def cache_store(self, job, result):
-        self.cache[job] = result
-        njob = self.normalize(job)
-        self.normalized_cache[njob] = result
-        with open(self.cache_file, 'wb') as f:
-            pickle.dump(self.cache, f)
-
-
-    def log(self, job, logs):
-        lines = logs.split('\n')
-        key_lines = []
-        prefixes = ['read:', 'write:', 'READ:', 'WRITE:']
-        for l in lines:
-            lt = l.strip()
-            for p in prefixes:
-                if lt.startswith(p):
-                    key_lines.append(l)
-                    break
+        self.store.put(job, result)
+
+
+    def log(self, job, result):
+        key_lines = fioresult.summary(resultstore.output(result))
 
         with self.lock:
             print('')
@@ -161,65 +148,184 @@ spec:
             print(job)
             print('\n'.join(key_lines))
 
-    def kubectl_apply(self, job, silent=True):
+    def job_name(self):
+        # Every Job gets its own name so that several of them can be live
+        # on the same cluster at once.
+        return 'fio-' + uuid.uuid4().hex[:12]
 
+    def manifest(self, name, job, node=None):
+        if self.runtime_class:
+            runtime_class = 'runtimeClassName: ' + self.runtime_class
+        else:
+            runtime_class = ''
+
+        if node:
+            node_selector = 'nodeSelector:\n        kubernetes.io/hostname: ' + node
+        else:
+            node_selector = ''
+
+        return self.template % {'runtime_class': runtime_class,
+                                'node_selector': node_selector,
+                                'name': name,
+                                'command': json.dumps(iologs.job_command),
+                                'args': json.dumps(jobspec.JobSpec.parse(job).command.split()),
+                                'job': job,
+                                'id': self.cluster}
+
+    def kubectl_apply(self, job, silent=True, node=None):
+        """Run job as a Kubernetes Job; return whether its result is in the cache."""
         result = self.cache_lookup(job)
         if result:
             if not silent:
                 self.log(job, result)
-            return
-
+            return True
 
-        if self.runtime_class:
-            runtime_class = 'runtimeClassName: ' + self.runtime_class
-        else:
-            runtime_class = ''
+        try:
+            config = self.configure(job, node)
+        except Exception as e:
+            print(e)
+            return False
 
-        jobtext = self.template % {'runtime_class': runtime_class, 'job': job, 'id': self.cluster}
-        jobfile = os.path.join(self.folder, 'job.yaml')
+        name = self.job_name()
+        jobs_folder = os.path.join(self.folder, 'jobs')
+        os.makedirs(jobs_folder, exist_ok=True)
+        jobfile = os.path.join(jobs_folder, name + '.yaml')
         with open(jobfile, 'w') as f:
-            f.write(jobtext)
-
-        subprocess.run(['kubectl', '--context='+ self.cluster,
-                        'delete', '-f', jobfile], capture_output=True)
+            f.write(self.manifest(name, job, node))
 
-        res = subprocess.run(['kubectl', '--context='+ self.cluster,
-                              'apply', '--overwrite=true', '-f', jobfile], capture_output=True)
+        spec = jobspec.JobSpec.parse(job)
+        self.tracker.track(name, '%s %s bs=%s numjobs=%s iodepth=%s' % (
+            self.runtime_class or 'runc', spec.get('readwrite'), spec.get('bs'),
+            spec.get('numjobs'), spec.get('iodepth')))
+        res = engine.kubectl(self.cluster, 'apply', '-f', jobfile)
 
         if res.returncode:
-            print(res.stderr.decode('utf-8'))
-            os._exit(res.returncode)
+            # Only this job fails; the other jobs and clusters go on.
+            print('%s: %s' % (self.cluster, res.stderr.decode('utf-8')))
+            self.tracker.forget(name)
+            os.remove(jobfile)
+            return False
+        print(res.stdout.decode('utf-8'))
+
+        sampler = self.telemetry.start(node) if self.telemetry else None
+        tracked = self.tracker.wait(name)
+        samples = sampler.stop() if sampler else None
+
+        # The Job name is never reused, so the next job does not wait for
+        # kubectl delete.
+        engine.kubectl(self.cluster, 'delete', '--wait=false', '-f', jobfile)
+        os.remove(jobfile)
+
+        result = None
+        if tracked.error:
+            print('%s: %s %s' % (self.cluster, name, tracked.error))
+            if tracked.logs:
+                print(tracked.logs)
         else:
-          print(res.stdout.decode('utf-8'))
+            result = self.store_result(job, tracked.logs, tracked.timings, silent, samples, config)
+        self.record_deletion(name, job, result)
+        return result is not None
+
+    def record_deletion(self, name, job, result=None):
+        """Wait for the Job's pod to be deleted in a thread of its own.
+
+        The result is stored before; once the deletion is seen pod_deleted
+        is added to it with a small update record.
+        """
+        def wait():
+            tracked = self.tracker.forget(name)
+            deleted = tracked.timings.get('pod_deleted') if tracked else None
+            if result and deleted:
+                self.store.update(job, {'pod_deleted': deleted})
+
+        thread = threading.Thread(target=wait, daemon=True)
+        thread.start()
+        with self.lock:
+            self.deleting = [t for t in self.deleting if t.is_alive()] + [thread]
 
-        try:
-            res = subprocess.run(['kubectl', '--context='+ self.cluster,
-                                  'wait', '--for=condition=complete',
-                                  'jobs.batch/fio-test',
-                                  '--timeout=600s'], capture_output=True)
-
-            for i in range(0, 10):
-                try:
-                    res = subprocess.run(['kubectl', '--context='+ self.cluster,
-                                          'get', 'pods'], capture_output=True)
-                    pod = res.stdout.decode('utf-8').strip().split('\n')[-1].split()[0]
-                    break
-                except:
-                    print('Failure')
-                    print(res.stdout.decode('utf-8'))
-
-            res = subprocess.run(['kubectl', '--context='+ self.cluster, 'logs', pod], capture_output=True)
-            logs = res.stdout.decode('utf-8')
-
-            self.cache_store(job, logs)
+    def fio_server_apply(self, job, silent=True, node=None):
+        result = self.cache_lookup(job)
+        if result:
             if not silent:
-                self.log(job, logs)
+                self.log(job, result)
+            return True
+
+        try:
+            config = self.configure(job, node)
+            server = self.servers.get(node)
+        except Exception as e:
+            print(e)
+            return False
 
+        sampler = self.telemetry.start(server.node) if self.telemetry else None
+        try:
+            logs = server.run(job)
         except Exception as e:
             print(e)
-            print(traceback.format_exc())
+            return False
+        finally:
+            samples = sampler.stop() if sampler else None
 
-        subprocess.run(['kubectl', '--context='+ self.cluster, 'delete', '-f', jobfile], capture_output=True)
+        self.store_result(job, logs, {}, silent, samples, config)
+        return True
+
+    def configure(self, job, node=None):
+        """Make kata on node (default: all nodes) use the job's settings.
+
+        Nodes that already have them are not touched. Returns the settings
+        and checksum of the config the job runs under, or None for runc.
+        """
+        if not self.runtime_class:
+            return None
+        spec = jobspec.JobSpec.parse(job)
+        # Settings the job does not sweep are pinned to the baseline.
+        settings = dict(kataconfig.baseline)
+        settings.update({k: kataconfig.parse_value(k, v) for k, v in spec.settings.items()})
+        states = kataconfig.manager.apply_cluster(self.cluster, settings, node)
+        failed = [s for s in states if s.status == 'failed']
+        if failed or not states:
+            raise RuntimeError('%s: could not configure kata on %s: %s' % (
+                self.cluster, node or 'all nodes', '; '.join(s.error for s in failed)))
+        if self.servers and any(s.status == 'applied' for s in states):
+            # Running fio servers use VMs started with the old config.
+            self.servers.discard(node)
+        return {'settings': states[0].settings, 'checksum': states[0].checksum}
+
+    def store_result(self, job, logs, timings, silent, samples=None, config=None):
+        logs, archive = iologs.split(logs)
+        timings = dict(timings, **fioresult.fio_times(logs))
+        result = {'output': logs, 'timings': timings}
+        if archive:
+            result['iologs'] = iologs.save(self.folder, jobspec.key(job), archive)
+        if samples:
+            result['telemetry'] = samples
+        if config:
+            result['kata_config'] = config
+        self.cache_store(job, result)
+        if not silent:
+            self.log(job, result)
+        return result
+
+    def execute(self, job, silent=True, node=None):
+        """Run job unless it is cached; return whether its result is stored."""
+        if self.servers:
+            return self.fio_server_apply(job, silent, node)
+        return self.kubectl_apply(job, silent, node)
+
+    def close(self):
+        # Pod deletions are seen through the tracker, so it must still watch.
+        with self.lock:
+            deleting, self.deleting = self.deleting, []
+        for thread in deleting:
+            thread.join()
+        if self.owns_tracker:
+            self.tracker.stop()
+        if self.servers:
+            self.servers.stop()
+
+    def gen_settings(self, settings):
+        """Return every combination of kata settings as job string suffixes."""
+        return [s.replace(' --', ' +') for s in self.gen_jobs(settings, '')]
 
     def default_options(self):
         options = [
@@ -236,15 +342,49 @@ spec:
         ]
         return options
 
-    def run(self, options, silent=True):
+    def jobs(self, options):
+        """Return the JobSpecs of every combination of options and kata settings."""
+        # Parse every job once; the resulting JobSpec carries the cache key.
+        # The output format is not part of the key, so results gathered as
+        # text before json+ output was used are still served from the cache.
+        # fio status lines let the tracker report progress and spot errors,
+        # and the bandwidth, IOPS and latency logs are kept as time series.
+        jobs = [jobspec.JobSpec.parse(j)
+                for j in self.gen_jobs(options, ' '.join(['fio --output-format=json+ '
+                                                          '--eta=always --eta-newline=5']
+                                                         + iologs.log_options))]
+        if self.settings:
+            jobs = [jobspec.JobSpec.parse(str(j) + s)
+                    for j in jobs for s in self.gen_settings(self.settings)]
+        return jobs
+
+    def prepare(self):
+        """Load the cache and start watching the cluster's Jobs if needed."""
+        self.load_cache()
+        if not self.tracker and not self.servers:
+            self.tracker = kube.JobTracker(kube.proxy_client(self.cluster), self.cluster)
+            self.owns_tracker = True
+            self.tracker.start()
+
+    def run(self, options, silent=True, scheduler=None):
         if not options:
             options = self.default_options()
 
-        self.load_cache()
-        # jobs = self.gen_jobs(options, 'fio')
-        # for j in jobs:
-        #     self.kubectl_apply(j, silent)
-        self.kubectl_apply('', False)
+        self.prepare()
+        jobs = self.jobs(options)
+        if scheduler:
+            # Only jobs that have to run take the scheduler's time.
+            for j in jobs:
+                result = self.cache_lookup(j)
+                if result:
+                    if not silent:
+                        self.log(j, result)
+                else:
+                    scheduler.submit(self, j, silent)
+        else:
+            for j in jobs:
+                self.execute(j, silent)
+            self.close()
 
 
 if __name__ == "__main__":
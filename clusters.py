@@ -3,14 +3,13 @@
 # Licensed under the MIT License
 
 import argparse
-import os
-import subprocess
+import asyncio
 import sys
-import threading
 
-import nodecmd
+import engine
+import kataconfig
 
-lock = threading.Lock()
+lock = asyncio.Lock()
 
 cluster_template = """
 ---
@@ -189,103 +188,119 @@ volumeBindingMode: WaitForFirstConsumer
 reclaimPolicy: Delete
 """
 
-def create_cluster(name, vm_size, enable_kata, args):
-    res = subprocess.run(['az', 'aks', 'create',
-                          '--resource-group', args.resource_group,
-                          '--name', name,
-                          '--node-count', '1',
-                          '--generate-ssh-keys',
-                          '--vm-set-type', 'Virtualmachinescalesets',
-                          '--node-vm-size', vm_size,
-                          '--location', args.location,
-                          '--subscription', args.subscription])
+def check(res, name, what):
     if res.returncode:
-        os._exit(res.returncode)
-
-    with lock:
-        res = subprocess.run(['az', 'aks', 'get-credentials',
-                              '--resource-group', args.resource_group,
-                              '--name', name,
-                              '--subscription', args.subscription,
-                              '--overwrite-existing'])
-
-    with open(f'cluster_{name}.yaml', 'w') as f:
-        f.write(cluster_template % {'id': name.lower()})
-
-    res = subprocess.run(['kubectl', 'apply', '-f', f'cluster_{name}.yaml'])
-
-    if res.returncode:
-        os._exit(res.returncode)
-
-    if enable_kata:
-        url_common = 'https://raw.githubusercontent.com/kata-containers/kata-containers/'
-        url_common += 'main/tools/packaging/kata-deploy/'
-
-        res = subprocess.run(['kubectl', 'apply', '--context', name, '-f',
-                             url_common + 'kata-rbac/base/kata-rbac.yaml'])
-        if res.returncode:
-            os._exit(res.returncode)
-
-        res = subprocess.run(['kubectl', 'apply', '--context', name, '-f',
-                             url_common + 'kata-deploy/base/kata-deploy-stable.yaml'])
-        if res.returncode:
-            os._exit(res.returncode)
-
-        res = subprocess.run(['kubectl', '--context', name, '-n', 'kube-system', 'wait',
+        raise RuntimeError('%s: %s failed: %s' % (name, what, res.stderr.decode('utf-8').strip()))
+    return res
+
+# Stages a new cluster goes through, in order. Storage, kata and labelled
+# only need the credentials and run concurrently.
+stages = ('created', 'credentials', 'storage', 'kata', 'labelled', 'ready')
+
+kata_url = ('https://raw.githubusercontent.com/kata-containers/kata-containers/'
+            'main/tools/packaging/kata-deploy/')
+
+
+class Provisioner:
+    """Readiness pipeline of new clusters.
+
+    Every cluster moves through `stages` on its own, so a cluster is ready,
+    and can start running jobs, as soon as its own stages are done rather
+    than when the slowest cluster is. `reached` keeps the last stage of each
+    cluster. az and kubectl are run through the engine, so the AZ and
+    KUBECTL environment variables can point them at stub executables.
+    """
+
+    def __init__(self, args, enable_kata=True):
+        self.args = args
+        self.enable_kata = enable_kata
+        self.reached = {}
+
+    def reach(self, name, stage):
+        self.reached[name] = stage
+        print('%s: %s' % (name, stage))
+
+    async def create(self, name, vm_size):
+        args = self.args
+        check(await engine.engine.az('aks', 'create',
+                                     '--resource-group', args.resource_group,
+                                     '--name', name,
+                                     '--node-count', '1',
+                                     '--generate-ssh-keys',
+                                     '--vm-set-type', 'Virtualmachinescalesets',
+                                     '--node-vm-size', vm_size,
+                                     '--location', args.location,
+                                     '--subscription', args.subscription,
+                                     # Creating takes minutes; no control plane slot is held.
+                                     limit=False), name, 'az aks create')
+
+    async def credentials(self, name):
+        # get-credentials rewrites the shared kubeconfig.
+        async with lock:
+            check(await engine.engine.az('aks', 'get-credentials',
+                                         '--resource-group', self.args.resource_group,
+                                         '--name', name,
+                                         '--subscription', self.args.subscription,
+                                         '--overwrite-existing'), name, 'az aks get-credentials')
+
+    async def storage(self, name):
+        with open(f'cluster_{name}.yaml', 'w') as f:
+            f.write(cluster_template % {'id': name.lower()})
+        check(await engine.engine.kubectl(name, 'apply', '-f', f'cluster_{name}.yaml'),
+              name, 'storage setup')
+
+    async def kata(self, name):
+        if not self.enable_kata:
+            return
+        e = engine.engine
+        check(await e.kubectl(name, 'apply', '-f', kata_url + 'kata-rbac/base/kata-rbac.yaml'),
+              name, 'kata-rbac')
+        check(await e.kubectl(name, 'apply', '-f', kata_url + 'kata-deploy/base/kata-deploy-stable.yaml'),
+              name, 'kata-deploy')
+        # Waiting takes no control plane slot; it can take minutes.
+        check(await e.kubectl(name, '-n', 'kube-system', 'wait',
                               '--timeout=10m', '--for=condition=Ready',
-                              '-l', 'name=kata-deploy', 'pod'])
-
-        if res.returncode:
-            os._exit(res.returncode)
-
-        res = subprocess.run(['kubectl', 'apply', '--context', name, '-f',
-                             url_common + 'runtimeclasses/kata-runtimeClasses.yaml'])
-
-        if res.returncode:
-            os._exit(res.returncode)
-
-    # Label NVME nodes
-    if 'Standard_L' in vm_size:
-        node = subprocess.run(['kubectl', 'get', 'nodes', '--output=name'], capture_output=True)
-
-        if node.returncode:
-            os._exit(node.returncode)
-
-        res = subprocess.run(['kubectl', 'label', '--overwrite', node.stdout.decode('utf-8').strip(), 'kubernetes.azure.com/aks-local-ssd=true'])
-        if res.returncode:
-            os._exit(res.returncode)
-
-def delete_cluster(name, args):
-    res = subprocess.run(['az', 'aks', 'delete', '-y',
-                          '--resource-group', args.resource_group,
-                          '--name', name,
-                          '--subscription', args.subscription])
-    if res.returncode:
-        os._exit(res.returncode)
-
-def _set_virtio_fs_buffering(name, enable):
-    cache_value = "auto" if enable else "none"
-    nodecmd.execute_command(
-        name, None, 'sed',
-        '-i', 's/virtio_fs_cache\s\+=\s\+".*"/virtio_fs_cache = "%s"/' % cache_value,
-        '/opt/kata/share/defaults/kata-containers/configuration-qemu.toml'
-    )
-
-    # Replace existing direct option
-    nodecmd.execute_command(
-        name, None, 'sed',
-        '-i', 's/"-o"\s*,\s*"\(no_\)\{0,1\}allow_direct_io"\s*,\{0,1\}//g',
-        '/opt/kata/share/defaults/kata-containers/configuration-qemu.toml'
-    )
-
-    # Set direct option correctly
-    direct_value = "allow_direct_io" if not enable else "no_allow_direct_io"
-    nodecmd.execute_command(
-        name, None, 'sed',
-        '-i', 's/virtio_fs_extra_args\s*=\s*\[/virtio_fs_extra_args = [ "-o", "%s", /g' % direct_value,
-        '/opt/kata/share/defaults/kata-containers/configuration-qemu.toml'
-    )
-
+                              '-l', 'name=kata-deploy', 'pod', limit=False),
+              name, 'waiting for kata-deploy')
+        check(await e.kubectl(name, 'apply', '-f', kata_url + 'runtimeclasses/kata-runtimeClasses.yaml'),
+              name, 'kata runtime classes')
+
+    async def label(self, name, vm_size):
+        # Label NVME nodes
+        if 'Standard_L' not in vm_size:
+            return
+        node = check(await engine.engine.kubectl(name, 'get', 'nodes', '--output=name'),
+                     name, 'listing nodes')
+        check(await engine.engine.kubectl(name, 'label', '--overwrite', node.stdout.decode('utf-8').strip(),
+                                          'kubernetes.azure.com/aks-local-ssd=true'),
+              name, 'labelling nodes')
+
+    async def stage(self, name, stage, coro):
+        await coro
+        self.reach(name, stage)
+
+    async def provision(self, name, vm_size):
+        """Take a cluster through every stage; raises if one fails."""
+        await self.stage(name, 'created', self.create(name, vm_size))
+        await self.stage(name, 'credentials', self.credentials(name))
+        results = await asyncio.gather(self.stage(name, 'storage', self.storage(name)),
+                                       self.stage(name, 'kata', self.kata(name)),
+                                       self.stage(name, 'labelled', self.label(name, vm_size)),
+                                       return_exceptions=True)
+        for r in results:
+            if isinstance(r, BaseException):
+                raise r
+        self.reach(name, 'ready')
+
+async def create_cluster(name, vm_size, enable_kata, args):
+    await Provisioner(args, enable_kata).provision(name, vm_size)
+
+async def delete_cluster(name, args):
+    check(await engine.engine.az('aks', 'delete', '-y',
+                                 '--resource-group', args.resource_group,
+                                 '--name', name,
+                                 '--subscription', args.subscription,
+                                 limit=False), name, 'az aks delete')
 
 clusters = [
     # ('cluster-2-1', 'Standard_D2s_v4'),
@@ -306,37 +321,40 @@ clusters = [
 ]
 
 
-def join_all(threads):
-    for t in threads:
-        t.join()
-
+def report(results, action):
+    failed = engine.failed(results)
+    if failed:
+        print('Could not %s %s' % (action, ', '.join(failed)))
+    return [name for name in results if name not in failed]
 
 def create_clusters(args):
-    threads = []
-    enable_kata = True
-    for c in clusters:
-        t = threading.Thread(target=create_cluster, args=(*c, enable_kata, args))
-        threads.append(t)
-        t.start()
-    join_all(threads)
+    """Create all clusters concurrently; return the names of those created.
+
+    A cluster that fails is reported and left out; the others go on.
+    """
+    provisioner = Provisioner(args, enable_kata=True)
+    return report(engine.run_all({c[0]: provisioner.provision(*c) for c in clusters}), 'create')
 
 def delete_clusters(args):
-    threads = []
-    for name,_ in clusters:
-        t = threading.Thread(target=delete_cluster, args=(name, args))
-        threads.append(t)
-        t.start()
-    join_all(threads)
+    return report(engine.run_all({name: delete_cluster(name, args) for name, _ in clusters}),
+                  'delete')
+
+def virtio_fs_settings(enable):
+    """Return the kata settings for buffered (enable) or direct virtio-fs I/O."""
+    return {'virtio_fs_cache': 'auto' if enable else 'none',
+            'allow_direct_io': not enable}
 
-def set_virtio_fs_buffering(enable):
-    for name, _ in clusters:
-        _set_virtio_fs_buffering(name, enable)
+def set_virtio_fs_buffering(enable, names=None):
+    # Nodes that already have the settings are left alone.
+    return kataconfig.apply(names or [name for name, _ in clusters], virtio_fs_settings(enable))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Create AKS fio benchmark clusters')
     parser.add_argument('action', choices=('create',
                                            'delete',
                                            'set-virtio-fs-direct',
+                                           'set-virtio-fs-buffered',
+                                           # Misspelled name kept for old scripts.
                                            'set-vritio-fs-buffered'))
     parser.add_argument('--subscription', '-s', type=str, required=True)
     parser.add_argument('--resource-group', '-rg', type=str, required=True)
@@ -345,12 +363,14 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     if args.action == 'create':
-        create_clusters(args)
+        if len(create_clusters(args)) < len(clusters):
+            sys.exit(1)
     elif args.action == 'delete':
-        delete_clusters(args)
+        if len(delete_clusters(args)) < len(clusters):
+            sys.exit(1)
     elif args.action == 'set-virtio-fs-direct':
         set_virtio_fs_buffering(False)
-    elif args.action == 'set-virtio-fs-buffered':
+    elif args.action in ('set-virtio-fs-buffered', 'set-vritio-fs-buffered'):
         set_virtio_fs_buffering(True)
     else:
         print("Unknown action %s" % args.action)
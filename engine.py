@@ -0,0 +1,167 @@
+#!/bin/python3
+# Copyright (c) Open Enclave SDK contributors.
+# Licensed under the MIT License
+
+import asyncio
+import concurrent.futures
+import os
+import subprocess
+import threading
+import traceback
+
+# Executables run for az and kubectl; tests can point these at stubs.
+az_command = os.environ.get('AZ', 'az')
+kubectl_command = os.environ.get('KUBECTL', 'kubectl')
+
+class Engine:
+    """Runs the az and kubectl calls of all clusters on one asyncio event loop.
+
+    Every call is an asyncio subprocess, so hundreds of them can be in flight
+    without a thread each. At most `control_plane` calls run at a time over
+    all clusters, and at most `per_cluster` of them against any one cluster,
+    so a busy cluster cannot starve the others of API calls. Long-lived
+    calls that stream work rather than call the API (a fio client in an exec)
+    and waits for long operations (az aks create) are run with limit=False.
+
+    The loop runs in a thread of its own, so the threads that wait for fio
+    jobs can use the engine through `call`. Cancelling a call, or
+    interrupting `run_all` with Ctrl-C, kills its subprocess.
+
+    `blocking` calls run on an executor of `threads` threads of their own:
+    each of them holds a thread for as long as a cluster runs jobs, so they
+    must not queue behind each other in the loop's default executor.
+    """
+
+    def __init__(self, control_plane=16, per_cluster=4, threads=None):
+        self.control_plane = control_plane
+        self.per_cluster = per_cluster
+        self.threads = threads
+        self.executor = None
+        self.lock = threading.Lock()
+        self.loop = None
+        self.thread = None
+        self.global_limit = None
+        self.cluster_limits = {}
+        # Set once the run is cancelled; workers take no new jobs.
+        self.cancelled = threading.Event()
+
+    def configure(self, control_plane=None, per_cluster=None, threads=None):
+        """Change the limits; only possible before the first call."""
+        if self.loop:
+            raise RuntimeError('engine limits cannot change once it runs')
+        self.control_plane = control_plane or self.control_plane
+        self.per_cluster = per_cluster or self.per_cluster
+        self.threads = threads or self.threads
+
+    def start(self):
+        with self.lock:
+            if not self.loop:
+                self.loop = asyncio.new_event_loop()
+                self.global_limit = asyncio.Semaphore(self.control_plane)
+                self.executor = concurrent.futures.ThreadPoolExecutor(
+                    self.threads, thread_name_prefix='engine-blocking')
+                self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+                self.thread.start()
+            return self.loop
+
+    def cluster_limit(self, cluster):
+        if cluster not in self.cluster_limits:
+            self.cluster_limits[cluster] = asyncio.Semaphore(self.per_cluster)
+        return self.cluster_limits[cluster]
+
+    async def exec(self, args, input=None, timeout=None):
+        proc = await asyncio.create_subprocess_exec(
+            *args, stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(input), timeout)
+        except BaseException:
+            # Cancelled or timed out.
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            raise
+        return subprocess.CompletedProcess(args, proc.returncode, stdout, stderr)
+
+    async def run(self, args, cluster=None, input=None, timeout=None, limit=True):
+        """Run a command and return its CompletedProcess with captured output."""
+        if not limit:
+            return await self.exec(args, input, timeout)
+        if cluster:
+            async with self.cluster_limit(cluster), self.global_limit:
+                return await self.exec(args, input, timeout)
+        async with self.global_limit:
+            return await self.exec(args, input, timeout)
+
+    async def kubectl(self, cluster, *args, **kwargs):
+        return await self.run([kubectl_command, '--context=' + cluster, *args], cluster, **kwargs)
+
+    async def az(self, *args, **kwargs):
+        return await self.run([az_command, *args], **kwargs)
+
+    def call(self, coro):
+        """Run coro on the engine's loop from another thread and return its result."""
+        loop = self.start()
+        if threading.current_thread() is self.thread:
+            raise RuntimeError('Engine.call used from the engine loop; await the coroutine')
+        future = asyncio.run_coroutine_threadsafe(coro, loop)
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()
+            raise
+
+    def kubectl_sync(self, cluster, *args, **kwargs):
+        return self.call(self.kubectl(cluster, *args, **kwargs))
+
+    async def isolated(self, name, coro):
+        """Await coro; an exception is printed and returned instead of raised."""
+        try:
+            return await coro
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print('%s: failed: %s' % (name, e))
+            print(traceback.format_exc())
+            return e
+
+    async def gather(self, tasks):
+        names = list(tasks)
+        results = await asyncio.gather(*(self.isolated(n, tasks[n]) for n in names))
+        return dict(zip(names, results))
+
+    def run_all(self, tasks):
+        """Run {name: coroutine} concurrently and return {name: result or exception}.
+
+        A task that fails does not affect the others. Ctrl-C cancels them all.
+        """
+        try:
+            return self.call(self.gather(tasks))
+        except KeyboardInterrupt:
+            self.cancel()
+            raise
+
+    def cancel(self):
+        """Cancel everything running on the loop and stop taking new jobs."""
+        self.cancelled.set()
+        if self.loop:
+            self.loop.call_soon_threadsafe(
+                lambda: [t.cancel() for t in asyncio.all_tasks(self.loop)])
+
+    async def blocking(self, fn, *args):
+        """Run blocking fn(*args) in a thread without blocking the loop."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+
+engine = Engine()
+
+def failed(results):
+    """Return the names of the tasks of a run_all result that failed."""
+    return sorted(n for n, r in results.items() if isinstance(r, BaseException))
+
+def kubectl(cluster, *args, **kwargs):
+    """Run kubectl against cluster from a thread; see Engine.run for kwargs."""
+    return engine.kubectl_sync(cluster, *args, **kwargs)
+
+def run_all(tasks):
+    return engine.run_all(tasks)
@@ -0,0 +1,173 @@
+#!/bin/python3
+# Copyright (c) Open Enclave SDK contributors.
+# Licensed under the MIT License
+
+import json
+import math
+import re
+
+import histogram
+
+# Text output of fio, used by results gathered before json+ output.
+read_re = re.compile(r'read: IOPS=(\d+\.?\d*)(k?), BW=(\d+\.?\d*)(MiB/s|KiB/s|B/s) \((\d+\.?\d*)(GB/s|MB/s|kB/s|B/s)\)')
+write_re = re.compile(r'write: IOPS=(\d+\.?\d*)(k?), BW=(\d+\.?\d*)(MiB/s|KiB/s|B/s) \((\d+\.?\d*)(GB/s|MB/s|kB/s|B/s)\)')
+
+decimal_units = {'GB/s': 1e3, 'MB/s': 1.0, 'kB/s': 1e-3, 'B/s': 1e-6}
+
+# clat percentiles reported as columns, in microseconds.
+percentiles = ['50.000000', '90.000000', '99.000000', '99.900000', '99.990000']
+
+def get_iops_bw(m):
+    iops = float(m[0])
+    if m[1] == 'k':
+        iops *= 1000
+    iops = math.ceil(iops)
+    bw = float(m[4]) * decimal_units[m[5]]
+    bw_raw = m[2] + m[3]
+    return (bw_raw, iops, bw)
+
+# fio prints these every --eta-newline seconds when run with --eta=always, e.g.
+# Jobs: 1 (f=1): [r(1)][25.0%][r=6492KiB/s,w=2787KiB/s][r=6492,w=2786 IOPS][eta 00m:45s]
+eta_re = re.compile(r'^Jobs: \d+ .*?\[([\d.]+)%\]\[([^\]]*)\]\[([^\]]*) IOPS\]\[eta ([^\]]+)\]')
+
+# Output that means the job cannot produce a useful result.
+fatal_patterns = [
+    re.compile(p) for p in (
+        r'^fio: .*(error|failed|Bad|bad|invalid)',
+        r'err=\s*[1-9]',
+        r'Permission denied',
+        r'Read-only file system',
+        r'No space left on device',
+        r'Transport endpoint is not connected',
+        r'Input/output error',
+        r'mount: ',
+    )]
+
+def parse_eta(line):
+    """Return the progress reported by a fio status line, or None."""
+    m = eta_re.search(line.strip())
+    if not m:
+        return None
+    return {'percent': float(m.group(1)), 'bw': m.group(2), 'iops': m.group(3), 'eta': m.group(4)}
+
+def fatal_error(line):
+    """Return line if it reports an error that makes the job useless."""
+    for p in fatal_patterns:
+        if p.search(line):
+            return line.strip()
+    return None
+
+def parse_json(output):
+    """Return the json output of fio found in output, or None.
+
+    The container prints a few lines before fio starts, and fio itself may
+    print warnings before the json document.
+    """
+    m = re.search(r'^\{', output, re.MULTILINE)
+    if not m:
+        return None
+    try:
+        return json.JSONDecoder().raw_decode(output, m.start())[0]
+    except ValueError:
+        return None
+
+def text_metrics(output):
+    varying = {'op': [], 'BW': [], 'IOPS': [], 'BW (MB/s)': []}
+    reads = read_re.findall(output)
+    writes = write_re.findall(output)
+    if len(reads) > 1 or len(writes) > 1:
+        varying['job'] = []
+    for op, matches in (('read', reads), ('write', writes)):
+        for idx, m in enumerate(matches):
+            bw_raw, iops, bw = get_iops_bw(m)
+            varying['op'].append(op)
+            varying['BW'].append(bw_raw)
+            varying['IOPS'].append(iops)
+            varying['BW (MB/s)'].append(bw)
+            if 'job' in varying:
+                varying['job'].append(idx if len(matches) > 1 else None)
+    return varying
+
+def usec(stats, name):
+    return stats[name]['mean'] / 1000.0 if name in stats else None
+
+# Metric columns of json output, and of every result with several jobs 'job'.
+json_columns = (['op', 'BW', 'IOPS', 'BW (MB/s)', 'clat mean (us)', 'slat mean (us)', 'lat mean (us)']
+                + ['clat p%s (us)' % p.rstrip('0').rstrip('.') for p in percentiles]
+                + ['usr_cpu', 'sys_cpu', 'disk util (%)', histogram.column])
+
+def json_metrics(data):
+    """Return columns of per-job, per-direction metrics from fio json output.
+
+    With group_reporting fio reports one job per group; otherwise every
+    job gets its own rows, numbered in the 'job' column.
+    """
+    # In client/server mode fio reports jobs under client_stats, plus an
+    # "All clients" summary when there are several clients.
+    jobs = data.get('jobs') or [j for j in data.get('client_stats', [])
+                                if j.get('jobname') != 'All clients']
+    columns = list(json_columns)
+    if len(jobs) > 1:
+        columns.append('job')
+    varying = {c: [] for c in columns}
+
+    disk_util = max((d['util'] for d in data.get('disk_util', [])), default=None)
+
+    for op in ('read', 'write', 'trim'):
+        for idx, job in enumerate(jobs):
+            stats = job.get(op)
+            if not stats or not stats.get('total_ios'):
+                continue
+            values = [op, '%dKiB/s' % stats['bw'], round(stats['iops']), stats['bw_bytes'] / 1e6,
+                      usec(stats, 'clat_ns'), usec(stats, 'slat_ns'), usec(stats, 'lat_ns')]
+            clat = stats.get('clat_ns', {}).get('percentile', {})
+            values += [clat[p] / 1000.0 if p in clat else None for p in percentiles]
+            hist = histogram.Histogram.from_fio(stats)
+            values += [job.get('usr_cpu'), job.get('sys_cpu'), disk_util,
+                       hist.encode() if hist else None]
+            if len(jobs) > 1:
+                values.append(idx)
+            for c, v in zip(columns, values):
+                varying[c].append(v)
+    return varying
+
+def fio_times(output):
+    """Return {'fio_started', 'fio_finished'} in seconds since the epoch, if known."""
+    data = parse_json(output)
+    if not data or 'timestamp_ms' not in data:
+        return {}
+    finished = data['timestamp_ms'] / 1000.0
+    jobs = data.get('jobs') or data.get('client_stats') or []
+    starts = [j['job_start'] / 1000.0 for j in jobs if j.get('job_start')]
+    if not starts:
+        # Older fio versions only report how long each job took.
+        starts = [finished - j['elapsed'] for j in jobs if 'elapsed' in j]
+    times = {'fio_finished': finished}
+    if starts:
+        times['fio_started'] = min(starts)
+    return times
+
+def metrics(output):
+    """Return the metrics columns of one fio result, json or text."""
+    data = parse_json(output)
+    if data is not None:
+        return json_metrics(data)
+    return text_metrics(output)
+
+def summary(output):
+    """Return the lines worth printing for one fio result."""
+    data = parse_json(output)
+    if data is None:
+        lines = []
+        prefixes = ['read:', 'write:', 'READ:', 'WRITE:']
+        for l in output.split('\n'):
+            lt = l.strip()
+            for p in prefixes:
+                if lt.startswith(p):
+                    lines.append(l)
+                    break
+        return lines
+
+    m = json_metrics(data)
+    return ['  %s: IOPS=%d, BW=%s, clat p99=%sus' % (op, iops, bw, p99)
+            for op, iops, bw, p99 in zip(m['op'], m['IOPS'], m['BW'], m['clat p99 (us)'])]
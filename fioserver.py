@@ -0,0 +1,172 @@
+#!/bin/python3
+# Copyright (c) Open Enclave SDK contributors.
+# Licensed under the MIT License
+
+import hashlib
+import threading
+import uuid
+
+import engine
+import iologs
+import jobspec
+
+class FioServer:
+    """A long-lived pod running `fio --server` on one node.
+
+    The pod is created once per node and runtime class, so scheduling, the
+    image check and (for kata-qemu) the VM boot are paid once instead of
+    for every fio invocation. Jobs are sent to it as job files by a fio
+    client started with `kubectl exec` in the same pod.
+    """
+
+    template = """
+apiVersion: v1
+kind: Pod
+metadata:
+  name: %(name)s
+  labels:
+    app: fio-server
+spec:
+  %(runtime_class)s
+  nodeSelector:
+    kubernetes.io/hostname: %(node)s
+  containers:
+    - name: fio-server
+      image: fangluguopub.azurecr.io/ubuntu-debug
+      command: ["sh", "-c", "cd \\"$DBENCH_MOUNTPOINT\\" && exec fio --server"]
+      imagePullPolicy: IfNotPresent
+      env:
+        - name: DBENCH_MOUNTPOINT
+          value: /s/mytmpfs
+      volumeMounts:
+        - mountPath: /s/azure-disk
+          name: azure-disk
+        - mountPath: /s/azure-file
+          name: azure-file
+        - mountPath: /s/mnt
+          name: host-drive
+        - mountPath: /s/mytmpfs
+          name: host-mytmpfs
+        - mountPath: /s/dbench
+          name: dbench
+  volumes:
+    - name: azure-disk
+      persistentVolumeClaim:
+        claimName: azure-disk-%(id)s
+    - name: azure-file
+      persistentVolumeClaim:
+        claimName: azure-file-%(id)s
+    - name: host-drive
+      hostPath:
+        path: /mnt
+    - name: host-mytmpfs
+      hostPath:
+        path: /mytmpfs
+    - name: dbench
+      persistentVolumeClaim:
+        claimName: dbench-%(id)s
+  restartPolicy: Never
+"""
+
+    def __init__(self, cluster, runtime_class, node):
+        self.cluster = cluster
+        self.runtime_class = runtime_class
+        self.node = node
+        suffix = hashlib.sha1(node.encode('utf-8')).hexdigest()[:8]
+        # Every server gets a new name: a discarded one may still be
+        # terminating, and a job must never run in its old VM.
+        self.name = 'fio-server-%s-%s-%s' % (runtime_class or 'runc', suffix, uuid.uuid4().hex[:6])
+
+    def kubectl(self, *args, **kwargs):
+        return engine.kubectl(self.cluster, *args, **kwargs)
+
+    def manifest(self):
+        if self.runtime_class:
+            runtime_class = 'runtimeClassName: ' + self.runtime_class
+        else:
+            runtime_class = ''
+        return self.template % {'name': self.name, 'node': self.node,
+                                'runtime_class': runtime_class, 'id': self.cluster}
+
+    def start(self):
+        res = self.kubectl('apply', '-f', '-', input=self.manifest().encode('utf-8'))
+        if res.returncode:
+            raise RuntimeError('%s: could not create %s: %s' %
+                               (self.cluster, self.name, res.stderr.decode('utf-8')))
+        # Waiting takes no control plane slot; a kata VM can take minutes to start.
+        res = self.kubectl('wait', '--for=condition=Ready', 'pod/' + self.name, '--timeout=600s',
+                           limit=False)
+        if res.returncode:
+            raise RuntimeError('%s: %s did not become ready: %s' %
+                               (self.cluster, self.name, res.stderr.decode('utf-8')))
+        print('%s: fio server %s is ready on %s' % (self.cluster, self.name, self.node))
+
+    def run(self, job):
+        """Run one job on the server and return the client's output."""
+        spec = jobspec.JobSpec.parse(job)
+        name = spec.digest[:16]
+        # Jobs may run concurrently in the same pod, so each one writes its
+        # logs to its own directory.
+        log_dir = '/tmp/%s.iolog' % name
+        script = ('mkdir -p %(log_dir)s && cat > /tmp/%(name)s.fio && '
+                  'fio --client=localhost %(args)s /tmp/%(name)s.fio; '
+                  'rc=$?; rm -f /tmp/%(name)s.fio; %(archive)s; exit $rc') % {
+                      'name': name, 'log_dir': log_dir, 'archive': iologs.archive_script(log_dir),
+                      'args': ' '.join(jobspec.command_line_options(spec))}
+        jobfile = jobspec.jobfile(spec).replace(iologs.log_dir + '/', log_dir + '/')
+        # The client runs as long as the job, so it takes no control plane slot.
+        res = self.kubectl('exec', '-i', self.name, '--', 'sh', '-c', script,
+                           input=jobfile.encode('utf-8'), limit=False)
+        if res.returncode:
+            raise RuntimeError('%s: fio client failed on %s: %s%s' %
+                               (self.cluster, self.name, res.stdout.decode('utf-8'),
+                                res.stderr.decode('utf-8')))
+        return res.stdout.decode('utf-8')
+
+    def stop(self):
+        self.kubectl('delete', 'pod', self.name, '--wait=false')
+
+
+class FioServers:
+    """The fio servers of one Benchmark, started on first use per node."""
+
+    def __init__(self, cluster, runtime_class):
+        self.cluster = cluster
+        self.runtime_class = runtime_class
+        self.lock = threading.Lock()
+        self.node_locks = {}
+        self.servers = {}
+
+    def first_node(self):
+        res = engine.kubectl(self.cluster, 'get', 'nodes', '--output=name')
+        if res.returncode:
+            raise RuntimeError(res.stderr.decode('utf-8'))
+        return res.stdout.decode('utf-8').split()[0].replace('node/', '')
+
+    def get(self, node=None):
+        if not node:
+            node = self.first_node()
+        with self.lock:
+            node_lock = self.node_locks.setdefault(node, threading.Lock())
+        # Servers on different nodes start concurrently.
+        with node_lock:
+            if node not in self.servers:
+                server = FioServer(self.cluster, self.runtime_class, node)
+                server.start()
+                self.servers[node] = server
+            return self.servers[node]
+
+    def discard(self, node=None):
+        """Stop the server on node (default: all nodes) so that the next job starts a new one."""
+        with self.lock:
+            nodes = [node] if node else list(self.servers)
+            for n in nodes:
+                server = self.servers.pop(n, None)
+                if server:
+                    server.stop()
+
+    def stop(self):
+        with self.lock:
+            for server in self.servers.values():
+                server.stop()
+            self.servers = {}
@@ -0,0 +1,161 @@
+#!/bin/python3
+# Copyright (c) Open Enclave SDK contributors.
+# Licensed under the MIT License
+
+import argparse
+import base64
+import os
+import zlib
+
+# Column of data.csv holding the encoded clat histogram of each row.
+column = 'clat hist'
+
+percentiles = [50, 90, 99, 99.9, 99.99]
+
+def varints(numbers):
+    out = bytearray()
+    for n in numbers:
+        while n >= 0x80:
+            out.append((n & 0x7f) | 0x80)
+            n >>= 7
+        out.append(n)
+    return bytes(out)
+
+def unvarints(data):
+    n = shift = 0
+    for b in data:
+        n |= (b & 0x7f) << shift
+        shift += 7
+        if not b & 0x80:
+            yield n
+            n = shift = 0
+
+
+class Histogram:
+    """Latency histogram in fio's buckets, mergeable without loss.
+
+    fio json+ output reports completion latencies as {bucket value (ns):
+    count} for its fixed log-linear buckets, so histograms of different
+    jobs, repeats and clusters are merged exactly by adding counts, and
+    percentiles of the merged histogram are as accurate as fio's own.
+    """
+
+    def __init__(self, counts=None):
+        self.counts = dict(counts or {})
+
+    @classmethod
+    def from_fio(cls, stats):
+        """Return the clat histogram of one direction of a json+ job, or None."""
+        bins = stats.get('clat_ns', {}).get('bins')
+        if not bins:
+            return None
+        return cls({int(v): int(c) for v, c in bins.items()})
+
+    def __iadd__(self, other):
+        for v, c in other.counts.items():
+            self.counts[v] = self.counts.get(v, 0) + c
+        return self
+
+    def __add__(self, other):
+        h = Histogram(self.counts)
+        h += other
+        return h
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def percentile(self, p):
+        """Return the bucket value (ns) below which p percent of the samples are."""
+        total = len(self)
+        if not total:
+            return None
+        target = total * p / 100.0
+        seen = 0
+        for v in sorted(self.counts):
+            seen += self.counts[v]
+            if seen >= target:
+                return v
+        return v
+
+    def encode(self):
+        """Return the histogram as a short string.
+
+        Bucket values are delta-encoded and, like the counts, written as
+        varints, then compressed and base64-encoded to fit in a CSV cell.
+        """
+        values = sorted(self.counts)
+        deltas = [b - a for a, b in zip([0] + values, values)]
+        data = varints([len(values)] + deltas + [self.counts[v] for v in values])
+        return base64.b64encode(zlib.compress(data, 9)).decode('ascii')
+
+    @classmethod
+    def decode(cls, text):
+        numbers = list(unvarints(zlib.decompress(base64.b64decode(text))))
+        n = numbers[0]
+        values = []
+        v = 0
+        for d in numbers[1:n + 1]:
+            v += d
+            values.append(v)
+        return cls(zip(values, numbers[n + 1:2 * n + 1]))
+
+def merge(encoded):
+    """Merge encoded histograms, skipping rows without one."""
+    h = Histogram()
+    for text in encoded:
+        if isinstance(text, str) and text:
+            h += Histogram.decode(text)
+    return h
+
+def group_columns(df):
+    """Return the columns of df whose rows have their histograms merged.
+
+    These are all columns that describe the job: every fio option, kata
+    setting and config, the operation, the runtime and the node. The node
+    column names the VM size, so replica clusters of the same size are
+    merged, as are fio's jobs and the repeats of a job.
+    """
+    import tocsv
+
+    results = tocsv.result_columns()
+    return [c for c in df.columns if c not in results]
+
+def report(df):
+    """Return true clat percentiles (us) of merged histograms per configuration."""
+    import pandas as pd
+
+    keys = group_columns(df)
+    rows = []
+    for group, hists in df[df[column].notna()].groupby(keys, observed=True, dropna=False)[column]:
+        h = merge(hists)
+        row = dict(zip(keys, group))
+        row['results'] = len(hists)
+        row['samples'] = len(h)
+        for p in percentiles:
+            v = h.percentile(p)
+            row['clat p%s (us)' % p] = v / 1000.0 if v is not None else None
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Report clat percentiles of merged fio histograms')
+    parser.add_argument('--input', '-i', type=str, default=None,
+                        help='data.parquet or data.csv written by tocsv.py (default: data.parquet if present)')
+    parser.add_argument('--output', '-o', type=str, default='latency.csv')
+
+    args = parser.parse_args()
+    import pandas as pd
+
+    path = args.input or ('data.parquet' if os.path.isfile('data.parquet') else 'data.csv')
+    if path.endswith('.parquet'):
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path)
+    # Categoricals from Parquet and numbers from CSV group the same way as strings.
+    df = df.astype({c: str for c in group_columns(df)})
+
+    latency = report(df)
+    pd.set_option('display.max_rows', None)
+    pd.set_option('display.width', 1000)
+    print(latency)
+    latency.to_csv(args.output, index=False)
@@ -0,0 +1,135 @@
+#!/bin/python3
+# Copyright (c) Open Enclave SDK contributors.
+# Licensed under the MIT License
+
+import argparse
+import base64
+import io
+import os
+import pathlib
+import tarfile
+
+import resultstore
+
+# fio writes its bandwidth, IOPS and latency logs under this prefix, e.g.
+# /tmp/iolog/fio_bw.1.log, and they are archived after the run.
+log_dir = '/tmp/iolog'
+log_options = ['--write_bw_log=%s/fio' % log_dir,
+               '--write_iops_log=%s/fio' % log_dir,
+               '--write_lat_log=%s/fio' % log_dir,
+               '--log_avg_msec=1000']
+
+marker = '=== fio iologs ==='
+
+def archive_script(directory=log_dir):
+    """Return shell that prints the logs in directory as a base64 tarball."""
+    return ('echo "%s"; tar czf - -C %s . 2>/dev/null | base64; rm -rf %s'
+            % (marker, directory, directory))
+
+# Container command wrapping the image entrypoint: it runs the job given as
+# arguments, then prints the logs after the fio output.
+job_command = ['sh', '-c', 'mkdir -p %s; "$@"; rc=$?; %s; exit $rc' % (log_dir, archive_script()),
+               'sh', '/docker-entrypoint.sh']
+
+kinds = {'bw': 'Bandwidth (KiB/s)', 'iops': 'IOPS', 'lat': 'Latency (ns)',
+         'clat': 'Completion latency (ns)', 'slat': 'Submission latency (ns)'}
+directions = {0: 'read', 1: 'write', 2: 'trim'}
+
+def split(output):
+    """Split container output into the fio output and the archived logs, if any."""
+    idx = output.find(marker + '\n')
+    if idx < 0:
+        return output, None
+    archive = ''.join(output[idx + len(marker) + 1:].split())
+    try:
+        archive = base64.b64decode(archive) if archive else None
+    except ValueError:
+        archive = None
+    return output[:idx], archive
+
+def save(folder, key, archive):
+    """Store an archive of fio logs next to the result store; return its name."""
+    os.makedirs(os.path.join(folder, 'iologs'), exist_ok=True)
+    name = os.path.join('iologs', key + '.tar.gz')
+    with open(os.path.join(folder, name + '.tmp'), 'wb') as f:
+        f.write(archive)
+    os.replace(os.path.join(folder, name + '.tmp'), os.path.join(folder, name))
+    return name
+
+def members(path, kind):
+    """Yield (member name, text stream) for the logs of one kind in an archive."""
+    with tarfile.open(path, 'r:gz') as tar:
+        for m in tar:
+            name = os.path.basename(m.name)
+            if m.isfile() and name.startswith('fio_%s.' % kind):
+                yield name, io.TextIOWrapper(tar.extractfile(m))
+
+def downsample(path, kind, bucket_ms=5000):
+    """Aggregate the logs of one kind in an archive into time buckets.
+
+    The logs are streamed line by line and only one (sum, count) pair per
+    bucket and direction is kept. Bandwidth and IOPS are averaged per job
+    and summed over jobs, latencies are averaged over all samples.
+    Returns {direction: [(seconds, value)]}.
+    """
+    totals = {}
+    for _, f in members(path, kind):
+        sums = {}
+        for line in f:
+            fields = line.split(',')
+            if len(fields) < 3:
+                continue
+            d = directions.get(int(fields[2]), fields[2].strip())
+            s = sums.setdefault((d, int(fields[0]) // bucket_ms), [0, 0])
+            s[0] += int(fields[1])
+            s[1] += 1
+        for k, (total, count) in sums.items():
+            t = totals.setdefault(k, [0, 0])
+            if kind in ('bw', 'iops'):
+                t[0] += total / count
+                t[1] = 1
+            else:
+                t[0] += total
+                t[1] += count
+
+    series = {}
+    for (d, bucket), (total, count) in sorted(totals.items()):
+        series.setdefault(d, []).append((bucket * bucket_ms / 1000.0, total / count))
+    return series
+
+def plot(series, kind, title, filename):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(11, 5))
+    for d, points in series.items():
+        ax.plot([p[0] for p in points], [p[1] for p in points], label=d)
+    ax.set(title=title, xlabel='Time (s)', ylabel=kinds[kind])
+    ax.legend()
+    fig.savefig(filename, bbox_inches='tight')
+    plt.close(fig)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Plot fio time-series logs of benchmark results')
+    parser.add_argument('folders', type=str, nargs='+',
+                        help='Result folders, e.g. data/cluster-2-1/Standard_D2s_v4/runc')
+    parser.add_argument('--kind', choices=sorted(kinds), default='bw')
+    parser.add_argument('--bucket-ms', type=int, default=5000,
+                        help='Width of the time buckets the logs are averaged into')
+    parser.add_argument('--output', '-o', type=str, default=os.path.join('figures', 'timeseries'))
+
+    args = parser.parse_args()
+    os.makedirs(args.output, exist_ok=True)
+
+    for folder in args.folders:
+        folder = pathlib.Path(folder)
+        for job, result in resultstore.ResultStore(folder).items():
+            name = resultstore.iologs(result)
+            if not name:
+                continue
+            series = downsample(folder / name, args.kind, args.bucket_ms)
+            key = os.path.basename(name).split('.')[0]
+            filename = os.path.join(args.output, '%s_%s_%s.png' % (folder.parts[-1], key[:16], args.kind))
+            plot(series, args.kind, '%s %s\n%s' % (folder.parts[-2], folder.parts[-1], job), filename)
+            print('Wrote %s' % filename)
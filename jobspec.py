@@ -0,0 +1,219 @@
+#!/bin/python3
+# Copyright (c) Open Enclave SDK contributors.
+# Licensed under the MIT License
+
+import functools
+import hashlib
+import itertools
+import re
+
+# fio accepts several names for some options.
+aliases = {
+    'rw': 'readwrite',
+    'blocksize': 'bs',
+    'iodepth_batch': 'iodepth_batch_submit',
+}
+
+# Options that only affect how fio reports results, not what it measures.
+ignored = ('output-format', 'output', 'status-interval', 'eta', 'eta-newline',
+           'write_bw_log', 'write_iops_log', 'write_lat_log', 'write_hist_log',
+           'log_avg_msec', 'log_hist_msec', 'per_job_logs')
+
+# Values fio uses when an option is not given.
+defaults = {
+    'bs': '4096',
+    'direct': '0',
+    'group_reporting': '0',
+    'iodepth': '1',
+    'ioengine': 'psync',
+    'numjobs': '1',
+    'ramp_time': '0',
+    'readwrite': 'read',
+    'time_based': '0',
+}
+
+# Options whose values are sizes (bytes) or times (seconds).
+size_options = ('bs', 'size', 'offset', 'offset_increment', 'filesize', 'io_size',
+                'bssplit', 'bsrange', 'blockalign', 'ba')
+time_options = ('runtime', 'ramp_time', 'startdelay')
+
+size_re = re.compile(r'^(\d+(?:\.\d+)?)\s*([kmgtp]?)(i?b?)$', re.IGNORECASE)
+time_re = re.compile(r'^(\d+(?:\.\d+)?)\s*(us|ms|s|m|h|d)?$', re.IGNORECASE)
+
+size_units = {'': 1, 'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30, 't': 1 << 40, 'p': 1 << 50}
+time_units = {'us': 1e-6, 'ms': 1e-3, 's': 1, None: 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+def format_number(n):
+    return str(int(n)) if float(n).is_integer() else repr(float(n))
+
+def normalize_size(value):
+    # Sizes may be lists like 4k,8k (read,write), ranges like 4k-16k or
+    # splits like 4k/50:8k/50; every part between the separators is
+    # normalised on its own (percentages are plain numbers and stay as they are).
+    def one(v):
+        m = size_re.match(v.strip())
+        if not m:
+            return v
+        return format_number(float(m.group(1)) * size_units[m.group(2).lower()])
+    return ''.join(one(part) for part in re.split(r'([:/,-])', value))
+
+def normalize_time(value):
+    m = time_re.match(value.strip())
+    if not m:
+        return value
+    unit = m.group(2).lower() if m.group(2) else None
+    return format_number(float(m.group(1)) * time_units[unit])
+
+
+class JobSpec:
+    """A parsed fio command line with a canonical, hashable key.
+
+    Option names are resolved through their aliases, size and time values
+    are converted to bytes and seconds, flags get the value 1 and options
+    fio would default are filled in, and options that only affect reporting
+    are left out. Two command lines that run the same benchmark therefore
+    have the same `key` and `digest`.
+
+    Tokens like `+virtio_fs_cache=none` are not passed to fio; they are the
+    kata settings the job must run under (`settings`) and are part of the
+    key, so results of different configs are never mixed up. `+repeat=N`
+    marks the Nth run of the same job; the first run has no such token, so
+    its key is that of the job.
+    """
+
+    def __init__(self, job, options, args, settings=None, repeat=1):
+        self.job = job
+        self.options = options
+        self.args = args
+        self.settings = settings or {}
+        self.repeat = repeat
+        self.key = tuple(sorted(options.items())) + tuple(args)
+        canonical = ['fio'] + ['--%s=%s' % kv for kv in sorted(options.items())] + list(args)
+        if self.settings:
+            self.key += tuple(('+' + k, v) for k, v in sorted(self.settings.items()))
+            canonical += ['+%s=%s' % kv for kv in sorted(self.settings.items())]
+        if repeat > 1:
+            self.key += (('+repeat', str(repeat)),)
+            canonical.append('+repeat=%d' % repeat)
+        self.canonical = ' '.join(canonical)
+        self.digest = hashlib.sha256(self.canonical.encode('utf-8')).hexdigest()
+        # The fio command line itself.
+        self.command = ' '.join(t for t in job.split() if not t.startswith('+'))
+
+    @classmethod
+    def parse(cls, job):
+        if isinstance(job, JobSpec):
+            return job
+        return parse(job)
+
+    def __str__(self):
+        return self.job
+
+    def __repr__(self):
+        return 'JobSpec(%r)' % self.job
+
+    def __eq__(self, other):
+        return isinstance(other, JobSpec) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def get(self, option, default=None):
+        return self.options.get(aliases.get(option, option), default)
+
+
+@functools.lru_cache(maxsize=None)
+def parse(job):
+    options = dict(defaults)
+    args = []
+    settings = {}
+    repeat = 1
+    for token in job.split():
+        if token.startswith('+'):
+            name, _, value = token[1:].partition('=')
+            if name == 'repeat':
+                repeat = int(value)
+            else:
+                settings[name] = value
+            continue
+        if not token.startswith('--'):
+            if token != 'fio':
+                args.append(token)
+            continue
+        name, sep, value = token[2:].partition('=')
+        name = aliases.get(name, name)
+        if name in ignored:
+            continue
+        if not sep:
+            value = '1'
+        elif name in size_options:
+            value = normalize_size(value)
+        elif name in time_options:
+            value = normalize_time(value)
+        options[name] = value
+    return JobSpec(job, options, args, settings, repeat)
+
+def with_option(job, name, value):
+    """Return the JobSpec of job with option name set to value."""
+    tokens = [t for t in str(job).split()
+              if not (t.startswith('--') and aliases.get(t[2:].partition('=')[0],
+                                                         t[2:].partition('=')[0]) == name)]
+    options = [t for t in tokens if not t.startswith('+')]
+    return parse(' '.join(options + ['--%s=%s' % (name, value)]
+                          + [t for t in tokens if t.startswith('+')]))
+
+def with_repeat(job, repeat):
+    """Return the JobSpec of the given run of job; run 1 is the job itself."""
+    tokens = [t for t in str(job).split() if not t.startswith('+repeat=')]
+    if repeat > 1:
+        tokens.append('+repeat=%d' % repeat)
+    return parse(' '.join(tokens))
+
+
+# Options fio only accepts on its command line, not in job files.
+command_line_only = ('output-format', 'output', 'status-interval', 'eta', 'eta-newline')
+
+def tokens(spec):
+    for token in spec.job.split():
+        if token.startswith('--'):
+            name, sep, value = token[2:].partition('=')
+            yield name, sep, value
+
+def command_line_options(spec):
+    return ['--%s%s%s' % t for t in tokens(spec) if t[0] in command_line_only]
+
+def jobfile(spec):
+    """Return the job as the contents of a fio job file."""
+    name = 'job'
+    lines = []
+    for option, sep, value in tokens(spec):
+        if option == 'name':
+            name = value
+        elif option not in command_line_only:
+            lines.append(option + sep + value)
+    return '\n'.join(['[%s]' % name] + lines) + '\n'
+
+
+def expand(options, cmd='fio'):
+    """Return the job strings of every combination of options.
+
+    options is a list of (name, value, ...) tuples; a tuple with several
+    values is swept, one with a single value is fixed, and one with just a
+    name is a flag. A single tuple value is taken as the list of values.
+    The last option varies fastest.
+    """
+    choices = []
+    for opt in options:
+        name, values = opt[0], opt[1:]
+        if len(values) == 1 and isinstance(values[0], tuple):
+            values = values[0]
+        if values:
+            choices.append([' --%s=%s' % (name, v) for v in values])
+        else:
+            choices.append([' --' + name])
+    return [cmd + ''.join(c) for c in itertools.product(*choices)]
+
+
+def key(job):
+    """Return the content address of a job string or JobSpec."""
+    return JobSpec.parse(job).digest
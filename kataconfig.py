@@ -0,0 +1,278 @@
+#!/bin/python3
+# Copyright (c) Open Enclave SDK contributors.
+# Licensed under the MIT License
+
+import argparse
+import base64
+import hashlib
+import re
+import threading
+
+import nodecmd
+
+config_path = '/opt/kata/share/defaults/kata-containers/configuration-qemu.toml'
+
+# Settings managed in the [hypervisor.qemu] section, with their types.
+# allow_direct_io is the "-o allow_direct_io" / "-o no_allow_direct_io"
+# option of virtiofsd in virtio_fs_extra_args.
+settings_types = {
+    'virtio_fs_cache': str,
+    'allow_direct_io': bool,
+    'virtio_fs_cache_size': int,
+    'virtio_fs_queue_size': int,
+}
+
+# Value of every managed setting unless a job sweeps it, so that settings
+# a job does not name cannot differ between runs with the same key. These
+# are direct virtio-fs I/O and kata's default cache and queue sizes, the
+# config results from before settings were swept were measured under.
+baseline = {
+    'virtio_fs_cache': 'none',
+    'allow_direct_io': True,
+    'virtio_fs_cache_size': 0,
+    'virtio_fs_queue_size': 1024,
+}
+
+section = '[hypervisor.qemu]'
+string_re = re.compile(r'"((?:[^"\\]|\\.)*)"')
+
+def digest(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def parse_value(name, value):
+    """Convert a setting given on the command line to its type."""
+    t = settings_types[name]
+    if t is bool:
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    return t(value)
+
+def key_re(name):
+    return re.compile(r'^\s*%s\s*=\s*(.*?)\s*$' % re.escape(name))
+
+def extra_args(text):
+    for line in text.splitlines():
+        m = key_re('virtio_fs_extra_args').match(line)
+        if m:
+            return string_re.findall(m.group(1))
+    return None
+
+def read(text):
+    """Return the managed settings found in the text of a kata config."""
+    settings = {}
+    for name in ('virtio_fs_cache', 'virtio_fs_cache_size', 'virtio_fs_queue_size'):
+        for line in text.splitlines():
+            m = key_re(name).match(line)
+            if m:
+                value = m.group(1).split('#')[0].strip()
+                settings[name] = settings_types[name](value.strip('"'))
+                break
+    args = extra_args(text) or []
+    for opt, value in zip(args, args[1:]):
+        if opt == '-o' and value in ('allow_direct_io', 'no_allow_direct_io'):
+            settings['allow_direct_io'] = value == 'allow_direct_io'
+    return settings
+
+def format_value(name, value):
+    if settings_types[name] is str:
+        return '"%s"' % value
+    return str(value)
+
+def render(text, settings):
+    """Return text with settings applied. Other lines are left untouched."""
+    lines = text.splitlines(keepends=True)
+    for name, value in settings.items():
+        if name == 'allow_direct_io':
+            continue
+        line = '%s = %s\n' % (name, format_value(name, value))
+        for i, l in enumerate(lines):
+            if key_re(name).match(l):
+                lines[i] = line
+                break
+        else:
+            # Not set (or commented out); add it to the section.
+            idx = next((i for i, l in enumerate(lines) if l.strip() == section), None)
+            if idx is None:
+                raise ValueError('%s not found in %s' % (section, config_path))
+            lines.insert(idx + 1, line)
+
+    if 'allow_direct_io' in settings:
+        option = 'allow_direct_io' if settings['allow_direct_io'] else 'no_allow_direct_io'
+        for i, l in enumerate(lines):
+            m = key_re('virtio_fs_extra_args').match(l)
+            if not m:
+                continue
+            args = string_re.findall(m.group(1))
+            kept = []
+            skip = False
+            for a, b in zip(args, args[1:] + [None]):
+                if skip:
+                    skip = False
+                elif a == '-o' and b in ('allow_direct_io', 'no_allow_direct_io'):
+                    skip = True
+                else:
+                    kept.append(a)
+            args = ['-o', option] + kept
+            lines[i] = 'virtio_fs_extra_args = [%s]\n' % ', '.join('"%s"' % a for a in args)
+            break
+        else:
+            raise ValueError('virtio_fs_extra_args not found in %s' % config_path)
+    return ''.join(lines)
+
+
+class NodeState:
+    def __init__(self, cluster, node, status, settings=None, checksum=None, error=None):
+        self.cluster = cluster
+        self.node = node
+        # 'unchanged', 'applied' or 'failed'
+        self.status = status
+        self.settings = settings or {}
+        self.checksum = checksum
+        self.error = error
+
+    def __repr__(self):
+        return 'NodeState(%r, %r, %r)' % (self.cluster, self.node, self.status)
+
+
+class ConfigManager:
+    """Idempotent, verified changes of the kata qemu config on cluster nodes.
+
+    The config of every node is read in one batch, the wanted settings are
+    applied to it locally, and only nodes whose config would change are
+    written. A written config is read back and its sha256 compared with the
+    one expected. Nodes are handled in parallel by the node agent and
+    clusters are handled concurrently.
+
+    The checksum of every config written or found up to date is remembered,
+    so asking again for the settings a node is known to have costs no node
+    work at all.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (cluster, node) -> (settings, checksum) last verified.
+        self.known = {}
+
+    def is_known(self, cluster, node, settings):
+        with self.lock:
+            state = self.known.get((cluster, node))
+        return state is not None and all(state[0].get(k) == v for k, v in settings.items())
+
+    def remember(self, cluster, node, settings, checksum):
+        with self.lock:
+            self.known[(cluster, node)] = (settings, checksum)
+
+    def read(self, cluster, nodes=None):
+        """Return {node: (text, checksum)} of the configs of a cluster."""
+        results = nodecmd.execute_commands(cluster, ['cat ' + config_path], nodes)
+        configs = {}
+        for node, (r,) in results.items():
+            if r.returncode != 0:
+                raise RuntimeError('%s %s: could not read %s: %s' % (cluster, node, config_path, r.stderr))
+            configs[node] = (r.stdout, digest(r.stdout))
+        return configs
+
+    def write(self, cluster, node, text):
+        """Replace the config of node with text and return its checksum on the node."""
+        data = base64.b64encode(text.encode('utf-8')).decode('ascii')
+        command = ('echo %s | base64 -d > %s.tmp && mv %s.tmp %s && sha256sum %s'
+                   % (data, config_path, config_path, config_path, config_path))
+        (r,) = nodecmd.execute_commands(cluster, [command], node)[node]
+        if r.returncode != 0:
+            raise RuntimeError(r.stderr)
+        return r.stdout.split()[0]
+
+    def apply_cluster(self, cluster, settings, node=None):
+        nodes = nodecmd.agent(cluster).pods()
+        nodes = [n for n in sorted(nodes) if node in (None, n)]
+        pending = [n for n in nodes if not self.is_known(cluster, n, settings)]
+        states = [NodeState(cluster, n, 'unchanged', settings, self.known[(cluster, n)][1])
+                  for n in nodes if n not in pending]
+        if not pending:
+            return states
+
+        configs = self.read(cluster, pending)
+        changes = []
+        for n in pending:
+            text, checksum = configs[n]
+            current = read(text)
+            wanted = render(text, settings)
+            if wanted == text:
+                self.remember(cluster, n, current, checksum)
+                states.append(NodeState(cluster, n, 'unchanged', current, checksum))
+            else:
+                diff = {k: (current.get(k), v) for k, v in settings.items() if current.get(k) != v}
+                print('%s %s: %s' % (cluster, n, ', '.join('%s %s -> %s' % (k, a, b)
+                                                          for k, (a, b) in sorted(diff.items()))))
+                changes.append((n, wanted))
+
+        def apply_node(n, wanted):
+            expected = digest(wanted)
+            try:
+                checksum = self.write(cluster, n, wanted)
+                if checksum != expected:
+                    raise RuntimeError('checksum %s does not match expected %s' % (checksum, expected))
+                settings_now = read(wanted)
+                self.remember(cluster, n, settings_now, checksum)
+                states.append(NodeState(cluster, n, 'applied', settings_now, checksum))
+            except Exception as e:
+                states.append(NodeState(cluster, n, 'failed', error=str(e)))
+
+        threads = [threading.Thread(target=apply_node, args=c) for c in changes]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return states
+
+    def apply(self, clusters, settings):
+        """Apply settings on every node of clusters concurrently; return NodeStates."""
+        states = []
+        lock = threading.Lock()
+
+        def apply_one(cluster):
+            try:
+                result = self.apply_cluster(cluster, settings)
+            except Exception as e:
+                result = [NodeState(cluster, None, 'failed', error=str(e))]
+            with lock:
+                states.extend(result)
+
+        threads = [threading.Thread(target=apply_one, args=(c,)) for c in clusters]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for s in sorted(states, key=lambda s: (s.cluster, s.node or '')):
+            if s.status == 'failed':
+                print('%s %s: kata config change failed: %s' % (s.cluster, s.node, s.error))
+        return states
+
+
+manager = ConfigManager()
+
+def apply(clusters, settings):
+    """Apply settings to the kata config of all nodes of clusters."""
+    return manager.apply(clusters, settings)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Show or change the kata qemu config of cluster nodes')
+    parser.add_argument('--cluster', '-c', type=str, action='append', required=True)
+    parser.add_argument('settings', type=str, nargs='*', metavar='NAME=VALUE',
+                        help='Settings to apply: %s' % ', '.join(sorted(settings_types)))
+
+    args = parser.parse_args()
+    settings = {}
+    for s in args.settings:
+        name, _, value = s.partition('=')
+        if name not in settings_types:
+            parser.error('unknown setting %s' % name)
+        settings[name] = parse_value(name, value)
+
+    if settings:
+        states = apply(args.cluster, settings)
+        for s in states:
+            print('%s %s: %s %s' % (s.cluster, s.node, s.status, s.checksum or s.error))
+    else:
+        for cluster in args.cluster:
+            for node, (text, checksum) in sorted(manager.read(cluster).items()):
+                print('%s %s: %s %s' % (cluster, node, read(text), checksum))
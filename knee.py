@@ -0,0 +1,138 @@
+#!/bin/python3
+# Copyright (c) Open Enclave SDK contributors.
+# Licensed under the MIT License
+
+import argparse
+import math
+
+import fioresult
+import jobspec
+import resultstore
+
+# Queue depths searched, the last one taken to be saturated.
+default_depths = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+def point(result):
+    """Return (IOPS, mean completion latency in us) of one result, or None."""
+    varying = fioresult.metrics(resultstore.output(result))
+    if not varying['op']:
+        return None
+    latencies = [v for v in varying.get('clat mean (us)', []) if v is not None]
+    return (sum(v or 0 for v in varying['IOPS']),
+            sum(latencies) / len(latencies) if latencies else None)
+
+def bracket(points, depths, tolerance):
+    """Return (lo, hi) indices of depths around the knee of the explored points.
+
+    The knee is the smallest depth whose IOPS is within tolerance of the
+    highest IOPS seen; hi is the smallest explored index that reaches it and
+    lo the largest explored index below hi. Returns None if none is known.
+    """
+    explored = sorted(i for i, d in enumerate(depths) if d in points)
+    if not explored:
+        return None
+    target = (1 - tolerance) * max(points[depths[i]][0] for i in explored)
+    hi = next(i for i in explored if points[depths[i]][0] >= target)
+    lo = max((i for i in explored if i < hi), default=None)
+    return lo, hi
+
+
+class Controller:
+    """Searches the saturation knee of every configuration over iodepth.
+
+    A configuration is a job without its iodepth: node, runtime class,
+    target, bs, readwrite, numjobs and so on. Its lowest and highest depth
+    run first; the highest is taken as saturated. The depths between the
+    largest one below `tolerance` of the best IOPS and the smallest one
+    above it are then split, with one new depth per free replica, until the
+    two are neighbours. With 9 depths that is 4 or 5 runs instead of 9, and
+    the latency at the knee is where it starts to climb. Every run is an
+    ordinary job, so its result is cached like any other.
+    """
+
+    def __init__(self, tolerance=0.1, depths=default_depths):
+        self.tolerance = tolerance
+        self.depths = tuple(depths)
+
+    def config(self, job):
+        return jobspec.with_option(job, 'iodepth', self.depths[0]).digest
+
+    def initial(self, job):
+        return [jobspec.with_option(job, 'iodepth', d) for d in (self.depths[0], self.depths[-1])]
+
+    def points(self, job, benches):
+        """Return {depth: (IOPS, latency)} of the depths with results in benches."""
+        points = {}
+        for d in self.depths:
+            run = jobspec.with_option(job, 'iodepth', d)
+            for bench in benches:
+                result = bench.cache_lookup(run)
+                p = point(result) if result else None
+                if p:
+                    points[d] = p
+                    break
+        return points
+
+    def more(self, jobs, benches, parallel=1):
+        points = self.points(jobs[0], benches)
+        b = bracket(points, self.depths, self.tolerance)
+        if not b or b[0] is None or b[1] - b[0] <= 1:
+            return []
+        planned = set(int(j.get('iodepth')) for j in jobs)
+        lo, hi = b
+        count = min(parallel, hi - lo - 1)
+        # Split [lo, hi] into count + 1 parts of about the same size.
+        indices = sorted(set(lo + round((hi - lo) * (i + 1) / (count + 1)) for i in range(count)))
+        # A depth that was run but has no result failed; do not retry it.
+        return [jobspec.with_option(jobs[0], 'iodepth', self.depths[i])
+                for i in indices if self.depths[i] not in planned]
+
+    def estimate(self, job, cached):
+        """Return the (fewest, most) runs of job's configuration still to do.
+
+        cached is the set of keys of the results on all replicas. The most
+        is a search that halves the bracket with every run.
+        """
+        done = sum(1 for d in self.depths if jobspec.with_option(job, 'iodepth', d).digest in cached)
+        most = min(len(self.depths), 2 + math.ceil(math.log2(max(1, len(self.depths) - 1))))
+        return max(0, min(2, len(self.depths)) - done), max(0, most - done)
+
+    def knee(self, jobs, benches):
+        """Return the knee depth of a configuration from its results so far, or None."""
+        b = bracket(self.points(jobs[0], benches), self.depths, self.tolerance)
+        return self.depths[b[1]] if b else None
+
+    def describe(self, jobs, benches):
+        points = self.points(jobs[0], benches)
+        knee = self.knee(jobs, benches)
+        return 'knee at iodepth=%s after %d runs: %s' % (knee, len(points), ', '.join(
+            '%d: %d IOPS %s' % (d, iops, '-' if lat is None else '%.0fus' % lat)
+            for d, (iops, lat) in sorted(points.items())))
+
+
+class Store:
+    """The results of a folder, looked up like a Benchmark's cache."""
+
+    def __init__(self, folder):
+        self.store = resultstore.ResultStore(folder)
+
+    def cache_lookup(self, job):
+        return self.store.get(job)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Print the iodepth knee of every configuration')
+    parser.add_argument('folders', type=str, nargs='+', help='Result folders')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Fraction below the best IOPS that still counts as saturated')
+
+    args = parser.parse_args()
+    for folder in args.folders:
+        store = Store(folder)
+        controller = Controller(args.tolerance, sorted(set(
+            int(jobspec.JobSpec.parse(job).get('iodepth')) for job, _ in store.store.items())))
+        configs = {}
+        for job, _ in store.store.items():
+            configs.setdefault(controller.config(job), []).append(jobspec.JobSpec.parse(job))
+        for jobs in sorted(configs.values(), key=lambda j: str(j[0])):
+            print('%s %s\n    %s' % (folder, jobspec.with_option(jobs[0], 'iodepth', '*'),
+                                     controller.describe(jobs, [store])))
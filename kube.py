@@ -0,0 +1,298 @@
+#!/bin/python3
+# Copyright (c) Open Enclave SDK contributors.
+# Licensed under the MIT License
+
+import datetime
+import json
+import re
+import subprocess
+import threading
+import time
+import traceback
+import urllib.parse
+import urllib.request
+
+import engine
+import fioresult
+
+class ApiClient:
+    """Minimal Kubernetes API client speaking plain HTTP.
+
+    It is meant to be pointed at `kubectl proxy` (see `proxy_client`), which
+    takes care of authentication, or at a fake API server in tests.
+    """
+
+    def __init__(self, server, namespace='default'):
+        self.server = server.rstrip('/')
+        self.namespace = namespace
+        self.proxy = None
+
+    def close(self):
+        if self.proxy:
+            self.proxy.terminate()
+            self.proxy = None
+
+    def path(self, kind, name=None):
+        if kind == 'jobs':
+            path = '/apis/batch/v1/namespaces/%s/jobs' % self.namespace
+        else:
+            path = '/api/v1/namespaces/%s/%s' % (self.namespace, kind)
+        if name:
+            path += '/' + name
+        return path
+
+    def request(self, path, params=None, timeout=None):
+        url = self.server + path
+        if params:
+            url += '?' + urllib.parse.urlencode(params)
+        return urllib.request.urlopen(url, timeout=timeout)
+
+    def list(self, kind, label_selector=None):
+        params = {'labelSelector': label_selector} if label_selector else None
+        with self.request(self.path(kind), params) as res:
+            return json.loads(res.read().decode('utf-8'))
+
+    def watch(self, kind, label_selector=None, resource_version=None):
+        """Yield (type, object) watch events until the server ends the stream."""
+        params = {'watch': '1', 'allowWatchBookmarks': 'true'}
+        if label_selector:
+            params['labelSelector'] = label_selector
+        if resource_version:
+            params['resourceVersion'] = resource_version
+        with self.request(self.path(kind), params) as res:
+            for line in res:
+                line = line.strip()
+                if line:
+                    event = json.loads(line.decode('utf-8'))
+                    yield event['type'], event['object']
+
+    def logs(self, pod, container=None):
+        params = {'container': container} if container else None
+        with self.request(self.path('pods', pod) + '/log', params) as res:
+            return res.read().decode('utf-8')
+
+    def follow_logs(self, pod, container=None):
+        """Yield log lines of a running pod until its container exits."""
+        params = {'follow': 'true'}
+        if container:
+            params['container'] = container
+        with self.request(self.path('pods', pod) + '/log', params) as res:
+            for line in res:
+                yield line.decode('utf-8', errors='replace')
+
+
+def proxy_client(cluster, namespace='default'):
+    """Start `kubectl proxy` for the given context and return a client for it."""
+    proc = subprocess.Popen([engine.kubectl_command, 'proxy', '--context', cluster, '--port=0'],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    line = proc.stdout.readline().decode('utf-8')
+    m = re.search(r'Starting to serve on (\S+)', line)
+    if not m:
+        proc.kill()
+        raise RuntimeError('%s: could not start kubectl proxy: %s%s' %
+                           (cluster, line, proc.stderr.read().decode('utf-8')))
+    client = ApiClient('http://' + m.group(1), namespace)
+    client.proxy = proc
+    return client
+
+
+def timestamp(value):
+    """Convert an RFC 3339 time from the API server to seconds since the epoch."""
+    if not value:
+        return None
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+class TrackedJob:
+    def __init__(self, name):
+        self.name = name
+        self.pod = None
+        self.logs = None
+        self.error = None
+        self.label = name
+        self.fetching = False
+        self.following = False
+        self.done = threading.Event()
+        self.deleted = threading.Event()
+        # Seconds since the epoch of job_created, pod_scheduled,
+        # container_started, container_finished and pod_deleted.
+        self.timings = {}
+
+    def record(self, event, value):
+        if value and event not in self.timings:
+            self.timings[event] = value
+
+    def fail(self, error):
+        if not self.done.is_set():
+            self.error = error
+            self.done.set()
+
+
+class JobTracker:
+    """Follows Job and Pod events of fio Jobs on one cluster.
+
+    Pods are mapped to their Job through the `job-name` label set by the Job
+    controller. Logs are fetched as soon as the fio container terminates, and
+    a failed Job or a pod that cannot start is reported immediately. The
+    lifecycle timestamps of every Job and its pod are recorded along the way.
+
+    While fio runs its log is followed: status lines are reported to
+    `progress`, and a fatal fio, mount or permission error fails the Job at
+    once so the caller can cancel it.
+    """
+
+    selector = 'app=fio-test'
+    fatal_reasons = ('ErrImagePull', 'ImagePullBackOff', 'InvalidImageName',
+                     'CreateContainerConfigError', 'CreateContainerError')
+
+    def __init__(self, client, cluster=None, progress=None):
+        self.client = client
+        self.cluster = cluster
+        self.progress = progress
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.threads = []
+        self.stopped = threading.Event()
+
+    def track(self, name, label=None):
+        """Start tracking a Job. Must be called before the Job is created."""
+        with self.lock:
+            self.jobs[name] = TrackedJob(name)
+            self.jobs[name].label = label or name
+            return self.jobs[name]
+
+    def get(self, name):
+        with self.lock:
+            return self.jobs.get(name)
+
+    def start(self):
+        for kind, handler in (('jobs', self.on_job), ('pods', self.on_pod)):
+            t = threading.Thread(target=self.follow, args=(kind, handler), daemon=True)
+            self.threads.append(t)
+            t.start()
+
+    def stop(self):
+        """Stop watching and close the client; the watch threads then exit."""
+        self.stopped.set()
+        self.client.close()
+
+    def follow(self, kind, handler):
+        resource_version = None
+        while not self.stopped.is_set():
+            try:
+                if not resource_version:
+                    listing = self.client.list(kind, self.selector)
+                    for obj in listing.get('items', []):
+                        handler('ADDED', obj)
+                    resource_version = listing['metadata'].get('resourceVersion')
+
+                for type, obj in self.client.watch(kind, self.selector, resource_version):
+                    if self.stopped.is_set():
+                        return
+                    if type == 'ERROR':
+                        # Most likely 410 Gone; start over from a fresh listing.
+                        resource_version = None
+                        break
+                    resource_version = obj['metadata'].get('resourceVersion', resource_version)
+                    if type != 'BOOKMARK':
+                        handler(type, obj)
+            except Exception as e:
+                if self.stopped.is_set():
+                    return
+                print('Watch of %s failed: %s' % (kind, e))
+                resource_version = None
+                self.stopped.wait(1)
+
+    def on_job(self, type, obj):
+        job = self.get(obj['metadata']['name'])
+        if not job:
+            return
+        job.record('job_created', timestamp(obj['metadata'].get('creationTimestamp')))
+        for c in obj.get('status', {}).get('conditions', None) or []:
+            if c['type'] == 'Failed' and c['status'] == 'True':
+                job.fail('Job failed: %s' % c.get('message', c.get('reason')))
+
+    def on_pod(self, type, obj):
+        job = self.get(obj['metadata'].get('labels', {}).get('job-name'))
+        if not job:
+            return
+        job.pod = obj['metadata']['name']
+
+        status = obj.get('status', {})
+        for c in status.get('conditions', None) or []:
+            if c['type'] == 'PodScheduled' and c['status'] == 'True':
+                job.record('pod_scheduled', timestamp(c.get('lastTransitionTime')))
+        for s in status.get('containerStatuses', None) or []:
+            state = s.get('state', {})
+            started = state.get('running', state.get('terminated', {})).get('startedAt')
+            job.record('container_started', timestamp(started))
+            job.record('container_finished', timestamp(state.get('terminated', {}).get('finishedAt')))
+        if type == 'DELETED':
+            # The API server's time, like the other timings; the local clock
+            # only if it did not set one.
+            job.record('pod_deleted', timestamp(obj['metadata'].get('deletionTimestamp'))
+                       or time.time())
+            job.deleted.set()
+
+        if job.done.is_set():
+            return
+        for s in status.get('containerStatuses', None) or []:
+            state = s.get('state', {})
+            waiting = state.get('waiting')
+            if waiting and waiting.get('reason') in self.fatal_reasons:
+                job.fail('%s: %s' % (waiting['reason'], waiting.get('message', '')))
+            elif 'running' in state and not job.following:
+                job.following = True
+                threading.Thread(target=self.follow_logs, args=(job,), daemon=True).start()
+            elif 'terminated' in state and not job.fetching:
+                job.fetching = True
+                threading.Thread(target=self.fetch_logs,
+                                 args=(job, state['terminated']), daemon=True).start()
+
+    def follow_logs(self, job):
+        lines = []
+        try:
+            for line in self.client.follow_logs(job.pod):
+                if job.done.is_set() or self.stopped.is_set():
+                    break
+                lines.append(line)
+                status = fioresult.parse_eta(line)
+                if status and self.progress:
+                    self.progress.update(self.cluster, job.name, job.label, status)
+                error = fioresult.fatal_error(line)
+                if error:
+                    job.logs = ''.join(lines)
+                    job.fail('fio error: %s' % error)
+        except Exception as e:
+            # The complete log is still fetched once the container exits.
+            if not self.stopped.is_set():
+                print('%s: following logs of %s failed: %s' % (self.cluster, job.pod, e))
+        finally:
+            if self.progress:
+                self.progress.finish(self.cluster, job.name)
+
+    def fetch_logs(self, job, terminated):
+        try:
+            job.logs = self.client.logs(job.pod)
+            if terminated.get('exitCode'):
+                job.error = 'Container exited with code %s' % terminated['exitCode']
+        except Exception as e:
+            job.error = str(e)
+            print(traceback.format_exc())
+        job.done.set()
+
+    def wait(self, name, timeout=600):
+        """Block until the Job finishes or fails and return its TrackedJob."""
+        job = self.get(name)
+        if not job.done.wait(timeout):
+            job.fail('Timed out after %ss' % timeout)
+        return job
+
+    def forget(self, name, timeout=60):
+        """Wait up to timeout for the Job's pod to be deleted and stop tracking it."""
+        job = self.get(name)
+        if job and job.pod:
+            job.deleted.wait(timeout)
+        with self.lock:
+            self.jobs.pop(name, None)
+        return job
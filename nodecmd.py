@@ -3,44 +3,218 @@
 # Licensed under the MIT License
 
 import argparse
-import os
-import subprocess
+import base64
+import json
+import shlex
+import sys
+import threading
+
+import engine
+
+template = """
+apiVersion: apps/v1
+kind: DaemonSet
+metadata:
+  name: node-agent
+  labels:
+    app: node-agent
+spec:
+  selector:
+    matchLabels:
+      app: node-agent
+  template:
+    metadata:
+      labels:
+        app: node-agent
+    spec:
+      hostPID: true
+      tolerations:
+        - operator: Exists
+      containers:
+        - name: agent
+          image: docker.io/library/alpine
+          command: ["sleep", "infinity"]
+          securityContext:
+            privileged: true
+          resources:
+            requests:
+              cpu: 10m
+              memory: 16Mi
+          volumeMounts:
+            - mountPath: /host
+              name: host
+      volumes:
+        - name: host
+          hostPath:
+            path: /
+"""
+
+# Runs in the host's root file system. Every command's exit code and
+# base64-encoded stdout and stderr are printed on one marker line each so
+# that output containing anything can be told apart.
+command_script = """
+out=$(mktemp); err=$(mktemp)
+sh -c %(command)s >$out 2>$err
+rc=$?
+echo "@@@ %(index)d $rc $(base64 -w0 <$out) $(base64 -w0 <$err)"
+rm -f $out $err
+"""
+
+
+class CommandResult:
+    def __init__(self, node, command, returncode, stdout, stderr):
+        self.node = node
+        self.command = command
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+
+    def __repr__(self):
+        return 'CommandResult(%r, %r, %r)' % (self.node, self.command, self.returncode)
+
+
+class NodeAgent:
+    """Runs commands on the nodes of a cluster through a persistent DaemonSet.
+
+    Every node runs an idle privileged pod in the host PID namespace with the
+    host's root file system at /host. Commands are sent in batches with one
+    `kubectl exec` per node, and the nodes of a cluster are served in
+    parallel, so no pod is created or deleted per command.
+    """
+
+    name = 'node-agent'
+
+    def __init__(self, cluster):
+        self.cluster = cluster
+        self.lock = threading.Lock()
+        self.ready = False
+        self.agents = {}
+
+    def kubectl(self, *args, **kwargs):
+        return engine.kubectl(self.cluster, *args, **kwargs)
+
+    def ensure(self):
+        """Create the DaemonSet if needed and wait until it runs on every node."""
+        with self.lock:
+            if self.ready:
+                return
+            res = self.kubectl('apply', '-f', '-', input=template.encode('utf-8'))
+            if not res.returncode:
+                # Waiting takes no control plane slot; it can take minutes.
+                res = self.kubectl('rollout', 'status', 'daemonset/' + self.name,
+                                   '--timeout=300s', limit=False)
+            if res.returncode:
+                raise RuntimeError('%s: could not start %s: %s' %
+                                   (self.cluster, self.name, res.stderr.decode('utf-8')))
+            self.ready = True
+
+    def pods(self):
+        """Return {node: agent pod} of the cluster's running agents."""
+        self.ensure()
+        with self.lock:
+            if not self.agents:
+                res = self.kubectl('get', 'pods', '-l', 'app=' + self.name, '-o', 'json')
+                if res.returncode:
+                    raise RuntimeError('%s: could not list %s pods: %s' %
+                                       (self.cluster, self.name, res.stderr.decode('utf-8')))
+                for pod in json.loads(res.stdout.decode('utf-8'))['items']:
+                    if pod['status'].get('phase') == 'Running':
+                        self.agents[pod['spec']['nodeName']] = pod['metadata']['name']
+            return dict(self.agents)
+
+    def pod(self, node):
+        pods = self.pods()
+        if node not in pods:
+            raise RuntimeError('%s: no %s pod on %s' % (self.cluster, self.name, node))
+        return pods[node]
+
+    def exec(self, node, *args, **kwargs):
+        """Run a command in the agent pod of node with kubectl exec."""
+        return self.kubectl('exec', '-i', self.pod(node), '--', *args, **kwargs)
+
+    def script(self, commands):
+        return ''.join(command_script % {'index': i, 'command': shlex.quote(c)}
+                       for i, c in enumerate(commands)).encode('utf-8')
+
+    def results(self, node, commands, res):
+        """Return a CommandResult per command from the output of a script."""
+        results = [CommandResult(node, c, None, '', '') for c in commands]
+        for line in res.stdout.decode('utf-8').splitlines():
+            fields = line.split(' ')
+            if fields[0] != '@@@' or len(fields) != 5:
+                continue
+            r = results[int(fields[1])]
+            r.returncode = int(fields[2])
+            r.stdout = base64.b64decode(fields[3]).decode('utf-8', errors='replace')
+            r.stderr = base64.b64decode(fields[4]).decode('utf-8', errors='replace')
+        if res.returncode and all(r.returncode is None for r in results):
+            for r in results:
+                r.stderr = res.stderr.decode('utf-8')
+        return results
+
+    def run_on(self, node, commands):
+        """Run commands on one node in order; return a CommandResult per command."""
+        res = self.exec(node, 'chroot', '/host', 'sh', '-s', input=self.script(commands))
+        return self.results(node, commands, res)
+
+    def run(self, commands, nodes=None):
+        """Run shell commands on nodes (default: all) concurrently.
+
+        Returns {node: [CommandResult]}. A command that could not be run at
+        all has a returncode of None.
+        """
+        pods = self.pods()
+        if nodes is None:
+            nodes = sorted(pods)
+        script = self.script(commands)
+
+        async def run_node(node):
+            if node not in pods:
+                raise RuntimeError('%s: no %s pod on %s' % (self.cluster, self.name, node))
+            res = await engine.engine.kubectl(self.cluster, 'exec', '-i', pods[node], '--',
+                                              'chroot', '/host', 'sh', '-s', input=script)
+            return self.results(node, commands, res)
+
+        results = engine.run_all({node: run_node(node) for node in nodes})
+        for node, r in results.items():
+            if isinstance(r, BaseException):
+                results[node] = [CommandResult(node, c, None, '', str(r)) for c in commands]
+        return results
+
+agents = {}
+agents_lock = threading.Lock()
+
+def agent(cluster):
+    """Return the NodeAgent of cluster, shared by all callers."""
+    with agents_lock:
+        if cluster not in agents:
+            agents[cluster] = NodeAgent(cluster)
+        return agents[cluster]
+
+def execute_commands(cluster, commands, node=None):
+    """Run shell commands on node, or on every node of cluster, and return the results."""
+    return agent(cluster).run(commands, [node] if node else None)
 
 def execute_command(cluster, node, cmd, *args):
-    if not node:
-        # Get names of nodes in the cluster
-        res = subprocess.run(['kubectl', 'get', 'nodes', '--output=name', '--context', cluster],
-                         capture_output=True)
-        if res.returncode:
-            print(res.stdout)
-            os._exit(res.returncode)
-
-        output = res.stdout.decode('utf-8').splitlines()
-
-        # Fetch the first node and remove node/ prefix
-        node = output[0].replace('node/', '')
-    print(f"Executing command on node: {node} in cluster {cluster}")
-    res = subprocess.run(['kubectl', 'debug', 'node/' + node,
-                          '--context', cluster,
-                          '-it', '--image=docker.io/library/alpine',
-                          '--', 'chroot', '/host', cmd, *args])
-
-    if not res.returncode:
-        res = subprocess.run(['kubectl', 'get', 'pods', '--context', cluster],
-                             capture_output=True)
-        if not res.returncode:
-            lines = res.stdout.decode('utf-8').split('\n')
-            for l in lines:
-                words = l.split()
-                if words and words[0].startswith('node-debugger'):
-                    subprocess.run(['kubectl', 'delete', 'pod', words[0],
-                                    '--context', cluster])
+    command = ' '.join(shlex.quote(a) for a in (cmd,) + args)
+    results = execute_commands(cluster, [command], node)
+    for node, node_results in sorted(results.items()):
+        for r in node_results:
+            print('%s %s: %s exited with %s' % (cluster, node, r.command, r.returncode))
+            if r.stdout:
+                print(r.stdout, end='')
+            if r.stderr:
+                print(r.stderr, end='', file=sys.stderr)
+    return results
 
 if __name__=="__main__":
-    parser = argparse.ArgumentParser(description='Execute command on AKS node')
+    parser = argparse.ArgumentParser(description='Execute command on AKS nodes')
     parser.add_argument('--cluster', '-c', type=str, required=True)
-    parser.add_argument('--node', '-n', type=str)
+    parser.add_argument('--node', '-n', type=str,
+                        help='Node to run the command on (default: all nodes)')
     parser.add_argument('command', type=str)
 
     args, unknown = parser.parse_known_args()
-    execute_command(args.cluster, args.node, args.command, *unknown)
+    results = execute_command(args.cluster, args.node, args.command, *unknown)
+    if any(r.returncode != 0 for rs in results.values() for r in rs):
+        sys.exit(1)
@@ -0,0 +1,255 @@
+#!/bin/python3
+# Copyright (c) Open Enclave SDK contributors.
+# Licensed under the MIT License
+
+import argparse
+import json
+import os
+import pickle
+import statistics
+
+import adaptive
+import benchmark
+import clusters
+import jobspec
+import knee
+import resultstore
+import scheduler
+
+# Seconds a job spends outside fio (scheduling, pod and VM start, teardown)
+# when no result of the same runtime class has recorded it yet.
+default_overhead = {'': 15.0, 'kata-qemu': 30.0}
+
+# Seconds a node needs to switch kata settings.
+switch_cost = 5.0
+
+# Seconds of fio run time assumed for jobs without a runtime.
+default_run = 60.0
+
+
+class Spec:
+    """Declarative description of a sweep, usually loaded from a JSON file.
+
+        {
+          "options": {"readwrite": ["randread", "randwrite"], "bs": "4k",
+                      "numjobs": [1, 2, 4], "group_reporting": true},
+          "runtimes": ["runc", "kata-qemu"],
+          "kata_settings": {"virtio_fs_cache": ["none", "auto"]},
+          "clusters": ["cluster-L8-1"]
+        }
+
+    A list of values is swept, a single value is fixed and `true` (or
+    null) is a flag. `clusters` defaults to every cluster in clusters.py.
+    """
+
+    def __init__(self, options, runtimes=('runc', 'kata-qemu'), kata_settings=None, clusters=None):
+        self.options = options
+        self.runtimes = list(runtimes)
+        self.kata_settings = kata_settings or []
+        self.clusters = clusters
+
+    @staticmethod
+    def tuples(values):
+        """Convert {name: value(s)} to the (name, value, ...) tuples of jobspec.expand."""
+        out = []
+        for name, v in values.items():
+            if v is None or v is True:
+                out.append((name,))
+            elif isinstance(v, list):
+                out.append(tuple([name] + v))
+            else:
+                out.append((name, v))
+        return out
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            spec = json.load(f)
+        return cls(cls.tuples(spec.get('options', {})),
+                   spec.get('runtimes', ['runc', 'kata-qemu']),
+                   cls.tuples(spec.get('kata_settings', {})),
+                   spec.get('clusters'))
+
+    def runtime_classes(self):
+        """Return the runtime classes to run; runc is the default class ''."""
+        return ['' if r == 'runc' else r for r in self.runtimes]
+
+
+class PlannedJob:
+    def __init__(self, cluster, bench, job, duration, runs=(1, 1)):
+        self.cluster = cluster
+        self.bench = bench
+        self.job = job
+        self.duration = duration
+        # Fewest and most runs still to do, over all replicas.
+        self.runs = runs
+
+def cached_keys(folder):
+    """Return the keys of the results stored in folder, including a legacy cache.pickle."""
+    keys = set(resultstore.ResultStore(folder).index)
+    cache_file = os.path.join(folder, 'cache.pickle')
+    if os.path.isfile(cache_file):
+        with open(cache_file, 'rb') as f:
+            keys.update(jobspec.key(job) for job in pickle.load(f))
+    return keys
+
+def measured_overhead(folder, limit=200):
+    """Return the median seconds outside fio of the latest results in folder, or None."""
+    store = resultstore.ResultStore(folder)
+    if not store.index:
+        return None
+    overheads = []
+    with open(store.path, 'rb') as f:
+        for key, _ in sorted(store.index.items(), key=lambda i: i[1])[-limit:]:
+            t = resultstore.timings(store.load(f, key)[1])
+            if all(k in t for k in ('job_created', 'pod_deleted', 'fio_started', 'fio_finished')):
+                overheads.append((t['pod_deleted'] - t['job_created'])
+                                 - (t['fio_finished'] - t['fio_started']))
+    return statistics.median(overheads) if overheads else None
+
+def replicas(spec):
+    """Return {node type: [cluster]} of the clusters of spec; each list is one ReplicaPool."""
+    groups = {}
+    for cluster, node_type in clusters.clusters:
+        if spec.clusters and cluster not in spec.clusters:
+            continue
+        groups.setdefault(node_type, []).append(cluster)
+    return groups
+
+def fio_seconds(job):
+    spec = jobspec.JobSpec.parse(job)
+    runtime = spec.get('runtime')
+    run = float(runtime) if runtime else default_run
+    return run + float(spec.get('ramp_time') or 0)
+
+
+class Plan:
+    """The jobs of a sweep that still need to run, in the order to run them.
+
+    Clusters of a node type are replicas that share one ReplicaPool, so
+    their jobs are planned together. Jobs are deduplicated by their key.
+    Every job is run `repeats` times (default: once per replica), and
+    results replicas already have count as repeats unless update_cache is
+    set. With a controller (adaptive.Controller, knee.Controller) a job is
+    a configuration whose number of runs the controller decides, so the
+    plan gives the fewest and most runs.
+
+    Each run's duration is its ramp_time plus runtime plus the overhead
+    measured for its runtime class. The work of a node type is shared by
+    its replicas with `parallel` jobs each; node types run concurrently.
+    """
+
+    def __init__(self, spec, update_cache=False, parallel=1, resource_group=None, subscription=None,
+                 repeats=0, controller=None):
+        self.spec = spec
+        self.parallel = parallel
+        self.controller = controller
+        self.replicas = replicas(spec)
+        self.jobs = {}
+        self.total = 0
+        self.cached = 0
+        for node_type, group in self.replicas.items():
+            count = 1 if controller else min(repeats or len(group), len(group))
+            items = []
+            for runtime_class in spec.runtime_classes():
+                folders = [os.path.join('data', c, node_type, runtime_class or 'runc') for c in group]
+                bench = benchmark.Benchmark(folders[0], group[0], resource_group, subscription,
+                                            runtime_class, update_cache,
+                                            settings=spec.kata_settings)
+                known = [set() if update_cache else cached_keys(f) for f in folders]
+                overhead = next((o for o in map(measured_overhead, folders) if o is not None),
+                                default_overhead.get(runtime_class, default_overhead['kata-qemu']))
+                seen = set()
+                for job in bench.jobs(spec.options or bench.default_options()):
+                    key = controller.config(job) if controller else job.digest
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    self.total += 1
+                    if controller:
+                        runs = controller.estimate(job, set().union(*known))
+                    else:
+                        todo = max(0, count - sum(1 for k in known if job.digest in k))
+                        runs = (todo, todo)
+                    if not runs[1]:
+                        self.cached += 1
+                        continue
+                    items.append(PlannedJob(node_type, bench, job, fio_seconds(job) + overhead, runs))
+            self.jobs[node_type] = scheduler.order(items, lambda p: scheduler.group_key(p.bench, p.job))
+
+    def switches(self, node_type):
+        groups = [scheduler.group_key(p.bench, p.job) for p in self.jobs[node_type]]
+        return sum(1 for a, b in zip(groups, groups[1:]) if a != b)
+
+    def seconds(self, node_type, most=True):
+        """Estimated wall-clock seconds of the jobs planned on node_type's replicas."""
+        work = sum(p.duration * p.runs[most] for p in self.jobs[node_type])
+        slots = len(self.replicas[node_type]) * max(1, self.parallel)
+        return work / slots + self.switches(node_type) * switch_cost
+
+    def eta(self, most=True):
+        return max((self.seconds(n, most) for n in self.jobs), default=0)
+
+    def describe(self, verbose=False):
+        lines = ['%d %s in the sweep, %d done, %d to run' % (
+            self.total, 'configurations' if self.controller else 'jobs',
+            self.cached, sum(len(j) for j in self.jobs.values()))]
+        for node_type, jobs in sorted(self.jobs.items()):
+            lines.append('%s on %s: %d jobs, %s runs, %d switches, %s' % (
+                node_type, ','.join(self.replicas[node_type]), len(jobs),
+                runs(sum(p.runs[0] for p in jobs), sum(p.runs[1] for p in jobs)),
+                self.switches(node_type),
+                span(self.seconds(node_type, False), self.seconds(node_type))))
+            previous = None
+            for p in jobs:
+                group = scheduler.group_key(p.bench, p.job)
+                if group != previous:
+                    count = sum(1 for q in jobs if scheduler.group_key(q.bench, q.job) == group)
+                    lines.append('  %-10s %-50s %d jobs' % (
+                        group[0] or 'runc', ' '.join('%s=%s' % kv for kv in group[1]), count))
+                    previous = group
+                if verbose:
+                    lines.append('    %6.0fs x%-5s %s' % (p.duration, runs(*p.runs), p.job))
+        lines.append('ETA: %s' % span(self.eta(False), self.eta()))
+        return '\n'.join(lines)
+
+def runs(fewest, most):
+    return str(most) if fewest == most else '%d-%d' % (fewest, most)
+
+def span(fewest, most):
+    if duration(fewest) == duration(most):
+        return duration(most)
+    return '%s to %s' % (duration(fewest), duration(most))
+
+def duration(seconds):
+    return '%dh%02dm' % (seconds // 3600, seconds % 3600 // 60)
+
+def controller(args):
+    """Return the controller of the --knee or --adaptive arguments, or None."""
+    if args.knee:
+        return knee.Controller(args.knee, [int(d) for d in args.knee_depths.split(',')])
+    if args.adaptive:
+        return adaptive.Controller(args.adaptive, args.confidence, args.max_repeats)
+    return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Print the plan and ETA of a benchmark sweep')
+    parser.add_argument('spec', type=str, help='JSON sweep spec')
+    parser.add_argument('--parallel', '-p', type=int, default=1)
+    parser.add_argument('--update-cache', '-uc', action='store_const', const=True)
+    parser.add_argument('--repeats', type=int, default=0, metavar='N',
+                        help='Runs of every job, each on another replica (default: all replicas)')
+    parser.add_argument('--adaptive', type=float, default=0, metavar='WIDTH',
+                        help='Plan for run_benchmarks.py --adaptive WIDTH')
+    parser.add_argument('--confidence', type=float, default=0.9)
+    parser.add_argument('--max-repeats', type=int, default=10, metavar='N')
+    parser.add_argument('--knee', type=float, default=0, metavar='TOLERANCE',
+                        help='Plan for run_benchmarks.py --knee TOLERANCE')
+    parser.add_argument('--knee-depths', type=str, default=','.join(str(d) for d in knee.default_depths))
+    parser.add_argument('--verbose', '-v', action='store_const', const=True,
+                        help='List every job with its estimated duration')
+
+    args = parser.parse_args()
+    plan = Plan(Spec.load(args.spec), args.update_cache, args.parallel,
+                repeats=args.repeats, controller=controller(args))
+    print(plan.describe(args.verbose))
@@ -2,6 +2,11 @@
 # Copyright (c) Open Enclave SDK contributors.
 # Licensed under the MIT License
 
+import argparse
+import concurrent.futures
+import functools
+import hashlib
+import json
 import pandas as pd
 import math
 import matplotlib.pyplot as plt
@@ -9,7 +14,10 @@ import os
 import seaborn as sns
 import sys
 
-df = pd.read_csv('data.csv')
+metrics      = ['BW (MB/s)', 'IOPS']
+
+# Only these columns are loaded.
+columns = ['ctr-runtime', 'node', 'readwrite', 'op', 'numjobs'] + metrics
 
 pd.set_option('display.max_rows', None)
 pd.set_option('display.max_columns', None)
@@ -17,32 +25,41 @@ pd.set_option('display.width', 1000)
 pd.set_option('display.colheader_justify', 'center')
 pd.set_option('display.precision', 3)
 
-# Remove columns that have constant values
-def remove_constant_columns(df):
-    for c in df.columns.copy():
-        col = df[c]
-        is_same = col.eq(col[0]).all()
-        if is_same:
-            df = df.drop(c, axis=1)
-    return df
-
-# Trim the table
-df = remove_constant_columns(df)
-df = df.drop('BW', axis=1)
-
-# Find list of nodes and runtimes. Order so that runc comes before kata.
-ctr_runtimes = sorted(df['ctr-runtime'].unique(), reverse=True)
-node_types   = sorted(df['node'].unique())
-readwrites   = list(df['readwrite'].unique())
-ops          = list(df['op'].unique())
-metrics      = ['BW (MB/s)', 'IOPS']
+@functools.lru_cache(maxsize=2)
+def read_csv(columns):
+    return pd.read_csv('data.csv', usecols=list(columns))
+
+def load(columns, readwrite=None, op=None):
+    """Load columns of the results, optionally only for one readwrite/op.
+
+    data.parquet (written by tocsv.py when pyarrow is available) is read
+    with the filters pushed down to the reader, so only matching row groups
+    are decoded. Otherwise data.csv is read and filtered.
+    """
+    filters = []
+    if readwrite is not None:
+        filters.append(('readwrite', '==', readwrite))
+    if op is not None:
+        filters.append(('op', '==', op))
+
+    if os.path.isfile('data.parquet'):
+        df = pd.read_parquet('data.parquet', columns=columns, filters=filters or None)
+        # Plot only the categories present in this slice.
+        for c in df.select_dtypes('category').columns:
+            df[c] = df[c].astype(str)
+        return df
+
+    df = read_csv(tuple(columns))
+    for c, _, v in filters:
+        df = df[df[c] == v]
+    return df.reset_index(drop=True)
 
 palette = 'pastel'
 fsize  = (11, 13)
 aspect = fsize[0]*1.0/fsize[1]
 
 figures_dir = 'figures'
-os.makedirs(figures_dir, exist_ok=True)
+figure_cache = os.path.join(figures_dir, '.cache.json')
 
 ylabels = {
     metrics[0] : 'Bandwidth (MB/s)',
@@ -62,8 +79,12 @@ def make_descriptive(readwrite, op):
 
     return op_name
 
+def figure_file(readwrite, op, metric, suffix):
+    op_name = make_descriptive(readwrite, op)
+    filename = (op_name + metric + suffix).replace(' ', '').replace('(MB/s)', '') + '.png'
+    return os.path.join(figures_dir, filename)
 
-def gen_cat_plots(df, readwrite, op, metric):
+def gen_cat_plots(df, readwrite, op, metric, ctr_runtimes):
     # Select records with given filters and make a copy.
     df = df[(df['readwrite'] == readwrite) & (df['op'] == op)].copy()
 
@@ -114,12 +135,11 @@ def gen_cat_plots(df, readwrite, op, metric):
 
     ax.set_xticklabels(rotation=45, horizontalalignment='right')
     g.fig.suptitle(title, y=1.05)
-    filename = (op_name + metric + 'Cat').replace(' ', '').replace('(MB/s)', '') + '.png'
-    g.fig.savefig(os.path.join(figures_dir, filename), bbox_inches='tight')
+    g.fig.savefig(figure_file(readwrite, op, metric, 'Cat'), bbox_inches='tight')
     plt.close()
 
 # Generate box and strip plots
-def gen_box_plots(df, readwrite, op, metric):
+def gen_box_plots(df, readwrite, op, metric, ctr_runtimes):
 
     # Select records with given filters and make a copy.
     df = df[(df['readwrite'] == readwrite) & (df['op'] == op)].copy()
@@ -176,11 +196,10 @@ def gen_box_plots(df, readwrite, op, metric):
     # to effectively remove the last two.
     plt.legend(handles[0:nlegends], labels[0:nlegends], borderaxespad=0.)
 
-    filename = (op_name + metric).replace(' ', '').replace('(MB/s)', '') + '.png'
-    ax.get_figure().savefig(os.path.join(figures_dir, filename))
+    ax.get_figure().savefig(figure_file(readwrite, op, metric, ''))
     plt.close()
 
-def gen_kde_plots(df, readwrite, op, metric):
+def gen_kde_plots(df, readwrite, op, metric, ctr_runtimes):
     # Select records with given filters and make a copy.
     df = df[(df['readwrite'] == readwrite) & (df['op'] == op)].copy()
 
@@ -206,14 +225,77 @@ def gen_kde_plots(df, readwrite, op, metric):
         hue_order=ctr_runtimes)
 
     ax.get_figure().suptitle(title, y=1.05)
-    filename = (op_name + metric + 'KDE').replace(' ', '').replace('(MB/s)', '') + '.png'
-    ax.get_figure().savefig(os.path.join(figures_dir, filename), bbox_inches='tight')
+    ax.get_figure().savefig(figure_file(readwrite, op, metric, 'KDE'), bbox_inches='tight')
     plt.close()
 
 
-for readwrite in readwrites:
-    for op in ops:
-        for metric in metrics:
-            gen_box_plots(df, readwrite, op, metric)
-            gen_cat_plots(df, readwrite, op, metric)
-            gen_kde_plots(df, readwrite, op, metric)
+plot_kinds = [('', gen_box_plots), ('Cat', gen_cat_plots), ('KDE', gen_kde_plots)]
+
+def slice_hash(df, *params):
+    """Hash a data slice together with the parameters used to plot it."""
+    h = hashlib.sha256()
+    h.update(repr(list(df.columns)).encode('utf-8'))
+    h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    h.update(repr(params).encode('utf-8'))
+    return h.hexdigest()
+
+def load_figure_cache():
+    if os.path.isfile(figure_cache):
+        with open(figure_cache) as f:
+            return json.load(f)
+    return {}
+
+def save_figure_cache(cache):
+    with open(figure_cache + '.tmp', 'w') as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.replace(figure_cache + '.tmp', figure_cache)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Plot fio results')
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help='Number of rendering processes (default: number of CPUs)')
+    parser.add_argument('--force', '-f', action='store_const', const=True,
+                        help='Render every figure even if its data did not change')
+
+    args = parser.parse_args()
+    os.makedirs(figures_dir, exist_ok=True)
+
+    # Find list of runtimes, readwrites and ops. Order so that runc comes before kata.
+    keys = load(['ctr-runtime', 'readwrite', 'op'])
+    ctr_runtimes = sorted(keys['ctr-runtime'].unique(), reverse=True)
+    readwrites   = list(keys['readwrite'].unique())
+    ops          = list(keys['op'].unique())
+
+    # Figures are keyed by their data slice, the plot parameters and this
+    # script, so a figure is only rendered again when one of those changed.
+    with open(__file__, 'rb') as f:
+        code_version = hashlib.sha256(f.read()).hexdigest()
+    cache = {} if args.force else load_figure_cache()
+
+    futures = {}
+    skipped = 0
+    with concurrent.futures.ProcessPoolExecutor(args.jobs) as pool:
+        for readwrite in readwrites:
+            for op in ops:
+                df = load(columns, readwrite, op)
+                if len(df) == 0:
+                    continue
+                for metric in metrics:
+                    for suffix, gen in plot_kinds:
+                        filename = figure_file(readwrite, op, metric, suffix)
+                        key = slice_hash(df, suffix, readwrite, op, metric, ctr_runtimes,
+                                         palette, fsize, code_version)
+                        if cache.get(filename) == key and os.path.isfile(filename):
+                            skipped += 1
+                            continue
+                        f = pool.submit(gen, df, readwrite, op, metric, ctr_runtimes)
+                        futures[f] = (filename, key)
+
+        for f in concurrent.futures.as_completed(futures):
+            filename, key = futures[f]
+            f.result()
+            cache[filename] = key
+            print('Rendered %s' % filename)
+
+    save_figure_cache(cache)
+    print('%d figures rendered, %d up to date.' % (len(futures), skipped))
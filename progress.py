@@ -0,0 +1,52 @@
+#!/bin/python3
+# Copyright (c) Open Enclave SDK contributors.
+# Licensed under the MIT License
+
+import threading
+import time
+
+class Progress:
+    """Live view of the fio jobs running on every cluster.
+
+    Job trackers report the status lines fio prints while running, and the
+    view prints the current IOPS/BW of every running job every `interval`
+    seconds, grouped by cluster.
+    """
+
+    def __init__(self, interval=10):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.stopped = threading.Event()
+
+    def update(self, cluster, name, label, status):
+        with self.lock:
+            self.jobs[(cluster, name)] = (label, status)
+
+    def finish(self, cluster, name):
+        with self.lock:
+            self.jobs.pop((cluster, name), None)
+
+    def render(self):
+        with self.lock:
+            jobs = sorted(self.jobs.items())
+        lines = ['--- %s: %d running jobs ---' % (time.strftime('%H:%M:%S'), len(jobs))]
+        cluster = None
+        for (c, name), (label, status) in jobs:
+            if c != cluster:
+                cluster = c
+                lines.append(cluster)
+            lines.append('  %-18s %5.1f%%  %-28s %-20s eta %-8s %s' % (
+                name, status['percent'], status['bw'], status['iops'], status['eta'], label))
+        return '\n'.join(lines)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            if self.jobs:
+                print(self.render())
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
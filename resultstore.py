@@ -0,0 +1,228 @@
+#!/bin/python3
+# Copyright (c) Open Enclave SDK contributors.
+# Licensed under the MIT License
+
+import argparse
+import os
+import pathlib
+import pickle
+import struct
+import threading
+import zlib
+
+import jobspec
+
+def output(result):
+    """Return the fio output of a stored result.
+
+    Results are stored as {'output': ..., 'timings': ...} dicts; caches
+    written before timings were recorded hold the output string itself.
+    """
+    return result if isinstance(result, str) else result['output']
+
+def timings(result):
+    return {} if isinstance(result, str) else result.get('timings', {})
+
+def iologs(result):
+    """Return the fio log archive of a result, relative to its folder, or None."""
+    return None if isinstance(result, str) else result.get('iologs')
+
+def telemetry(result):
+    """Return the encoded node telemetry samples of a result, or None."""
+    return None if isinstance(result, str) else result.get('telemetry')
+
+def kata_config(result):
+    """Return {'settings', 'checksum'} of the kata config a result ran under, or None."""
+    return None if isinstance(result, str) else result.get('kata_config')
+
+
+class ResultStore:
+    """Append-only store of fio results.
+
+    Each result is appended to `results.log` as one record and fsynced, so
+    storing a result costs the same no matter how many results there are,
+    and a crash can at worst lose the record being written. Records are
+
+        <job length> <value length> <crc32> <job> <pickled (job, result)>
+
+    On open only the record headers and jobs are read to build an in-memory
+    index from the job's key (by default its JobSpec digest) to the record
+    offset; values are read on lookup.
+
+    Timings learnt after a result was stored (the pod deletion) are
+    appended as small update records, flagged in the job length, and
+    merged into the result when it is read.
+
+    Only a store opened as the writer may append, and only the writer drops
+    a torn record at the end of the file. Readers stop at it and leave the
+    file alone, since it may be a record a running benchmark is writing.
+    """
+
+    header = struct.Struct('<III')
+    update_flag = 1 << 31
+
+    def __init__(self, folder, key=None, writer=False, part=None):
+        self.path = os.path.join(folder, 'results.log')
+        self.key = key or jobspec.key
+        self.writer = writer
+        self.lock = threading.Lock()
+        self.index = {}
+        # key -> entries of the update records of the result, oldest first
+        self.updates = {}
+        if part is None:
+            self.load_index()
+        else:
+            # A part of an index loaded before, e.g. by the parent of a worker.
+            self.index = dict(part[0])
+            self.updates = dict(part[1])
+
+    def load_index(self):
+        end = 0
+        if os.path.isfile(self.path):
+            with open(self.path, 'rb') as f:
+                while True:
+                    head = f.read(self.header.size)
+                    if len(head) < self.header.size:
+                        break
+                    klen, vlen, crc = self.header.unpack(head)
+                    update = klen & self.update_flag
+                    klen &= ~self.update_flag
+                    key = f.read(klen)
+                    value_offset = f.tell()
+                    f.seek(vlen, os.SEEK_CUR)
+                    if len(key) < klen or f.tell() > os.fstat(f.fileno()).st_size:
+                        break
+                    key = self.key(key.decode('utf-8'))
+                    if update:
+                        self.updates.setdefault(key, []).append((value_offset, vlen, crc))
+                    else:
+                        self.index[key] = (value_offset, vlen, crc)
+                        self.updates.pop(key, None)
+                    end = f.tell()
+
+            # Drop a record torn by a crash during append.
+            if self.writer and end < os.path.getsize(self.path):
+                with open(self.path, 'r+b') as f:
+                    f.truncate(end)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, job):
+        return self.key(job) in self.index
+
+    def parts(self, size):
+        """Split the index into parts of at most size results for ResultStore(part=...)."""
+        items = list(self.index.items())
+        return [(items[i:i + size], {k: self.updates[k] for k, _ in items[i:i + size]
+                                     if k in self.updates})
+                for i in range(0, len(items), size)]
+
+    def read(self, f, entry):
+        offset, vlen, crc = entry
+        f.seek(offset)
+        value = f.read(vlen)
+        if zlib.crc32(value) != crc:
+            raise IOError('%s: corrupt record at offset %d' % (self.path, offset))
+        return pickle.loads(value)
+
+    def load(self, f, key):
+        """Return the (job, result) of key with its updates merged."""
+        job, result = self.read(f, self.index[key])
+        for entry in self.updates.get(key, []):
+            result = dict(result, timings=dict(timings(result), **self.read(f, entry)[1]))
+        return job, result
+
+    def crc(self, key):
+        """Return a crc of the result of key that changes with its updates."""
+        crc = self.index[key][2]
+        for entry in self.updates.get(key, []):
+            crc = zlib.crc32(struct.pack('<I', entry[2]), crc)
+        return crc
+
+    def get(self, job):
+        key = self.key(job)
+        if key not in self.index:
+            return None
+        with open(self.path, 'rb') as f:
+            return self.load(f, key)[1]
+
+    def append(self, job, value, update=False):
+        if not self.writer:
+            raise RuntimeError('%s: store opened read-only' % self.path)
+        key = self.key(job)
+        raw = str(job).encode('utf-8')
+        value = pickle.dumps((str(job), value))
+        crc = zlib.crc32(value)
+        flags = self.update_flag if update else 0
+        with self.lock:
+            with open(self.path, 'ab') as f:
+                f.write(self.header.pack(len(raw) | flags, len(value), crc) + raw)
+                offset = f.tell()
+                f.write(value)
+                f.flush()
+                os.fsync(f.fileno())
+            if update:
+                self.updates.setdefault(key, []).append((offset, len(value), crc))
+            else:
+                self.index[key] = (offset, len(value), crc)
+                self.updates.pop(key, None)
+
+    def put(self, job, result):
+        self.append(job, result)
+
+    def update(self, job, timings):
+        """Add timings to the stored result of job without storing it again."""
+        self.append(job, timings, update=True)
+
+    def items(self):
+        """Yield the latest (job, result) for every key."""
+        if not self.index:
+            return
+        with open(self.path, 'rb') as f:
+            for key, _ in sorted(self.index.items(), key=lambda i: i[1]):
+                yield self.load(f, key)
+
+    def import_pickle(self, cache_file):
+        """Import results from a legacy cache.pickle not already in the store."""
+        with open(cache_file, 'rb') as f:
+            cache = pickle.load(f)
+        imported = 0
+        for job, result in cache.items():
+            if job not in self:
+                self.put(job, result)
+                imported += 1
+        return imported
+
+
+def load(folder, key=None):
+    """Return the results in folder as a {job: result} dict.
+
+    Prefers results.log and falls back to a legacy cache.pickle.
+    """
+    if os.path.isfile(os.path.join(folder, 'results.log')):
+        return dict(ResultStore(folder, key).items())
+    cache_file = os.path.join(folder, 'cache.pickle')
+    if os.path.isfile(cache_file):
+        with open(cache_file, 'rb') as f:
+            return pickle.load(f)
+    return {}
+
+
+def result_folders(root='.'):
+    """Return the sorted folders under root that hold results."""
+    root = pathlib.Path(root)
+    folders = set(p.parent for p in root.rglob('results.log'))
+    folders.update(p.parent for p in root.rglob('cache.pickle'))
+    return sorted(folders)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Import cache.pickle files into result stores')
+    parser.add_argument('root', type=str, nargs='?', default='data')
+
+    args = parser.parse_args()
+    for p in sorted(pathlib.Path(args.root).rglob('cache.pickle')):
+        store = ResultStore(p.parent, writer=True)
+        n = store.import_pickle(p)
+        print('%s: imported %d of %d results' % (p.parent, n, len(store)))
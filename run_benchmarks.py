@@ -4,22 +4,68 @@
 
 import argparse
 import os
-import threading
+import sys
 
 import benchmark
 import clusters
+import engine
+import knee
+import kube
+import planner
+import progress
+import scheduler
+import telemetry
 
 parser = argparse.ArgumentParser(description='Run AKS fio unbuffered benchmarks')
 parser.add_argument('--subscription', '-s', type=str, required=True)
 parser.add_argument('--resource-group', '-rg', type=str, required=True)
 parser.add_argument('--location', '-l', type=str, default='CentralUS')
 parser.add_argument('--manage-clusters', action='store_const', const=True)
+parser.add_argument('--parallel', '-p', type=int, default=1,
+                    help='Number of fio Jobs to run concurrently per cluster')
+parser.add_argument('--per-node', type=int, default=1,
+                    help='Maximum number of concurrent fio Jobs per node')
+parser.add_argument('--fio-server', action='store_const', const=True,
+                    help='Run jobs on a long-lived fio server pod per node and runtime '
+                         'class instead of one Kubernetes Job per fio invocation')
+
+parser.add_argument('--repeats', type=int, default=0, metavar='N',
+                    help='Run every job on N replica clusters of its node type '
+                         '(default: all replicas)')
+parser.add_argument('--adaptive', type=float, default=0, metavar='WIDTH',
+                    help='Rerun every configuration until the confidence interval of its median '
+                         'IOPS and BW is narrower than WIDTH times the median (e.g. 0.05)')
+parser.add_argument('--confidence', type=float, default=0.9,
+                    help='Confidence of the interval used by --adaptive')
+parser.add_argument('--max-repeats', type=int, default=10, metavar='N',
+                    help='Most runs of a configuration with --adaptive')
+parser.add_argument('--knee', type=float, default=0, metavar='TOLERANCE',
+                    help='Instead of sweeping iodepth, search the smallest iodepth of every '
+                         'configuration whose IOPS is within TOLERANCE (e.g. 0.1) of saturation')
+parser.add_argument('--knee-depths', type=str, default=','.join(str(d) for d in knee.default_depths),
+                    help='iodepths the --knee search chooses from')
+parser.add_argument('--control-plane-limit', type=int, default=16, metavar='N',
+                    help='Maximum number of concurrent az/kubectl calls over all clusters')
+parser.add_argument('--cluster-limit', type=int, default=4, metavar='N',
+                    help='Maximum number of concurrent kubectl calls per cluster')
+parser.add_argument('--progress', type=int, default=0, metavar='SECONDS',
+                    help='Print the IOPS/BW of every running job at this interval')
+parser.add_argument('--spec', type=str, default=None,
+                    help='JSON sweep spec (see planner.py) to run instead of the options below')
+parser.add_argument('--dry-run', action='store_const', const=True,
+                    help='Print the jobs that would run and the estimated time, then exit')
+parser.add_argument('--telemetry', type=float, default=0, metavar='SECONDS',
+                    help='Sample CPU, disk, pressure and virtiofsd/qemu counters of the '
+                         'node running each job at this interval')
 
 args = parser.parse_args()
 
-# Create containerd and kata clusters
-if args.manage_clusters:
-    clusters.create_clusters(args)
+view = None
+if args.progress:
+    view = progress.Progress(args.progress)
+    view.start()
+
+engine.engine.configure(args.control_plane_limit, args.cluster_limit)
 
 options = [
 #     ('name', 'test'),
@@ -36,53 +82,97 @@ options = [
 #     ('numjobs', '1', '2', '4'),
 ]
 
-def run_benchmark(cluster_name, node_type, options):
-    folder = os.path.join('data', cluster_name, node_type, 'runc')
-    os.makedirs(folder, exist_ok=True)
-
-    runtime_class = ''
-    bench = benchmark.Benchmark(folder, cluster_name, args.resource_group,
-                                args.subscription, runtime_class,
-                                False)
-    bench.run(options, False)
-
-    folder = os.path.join('data', cluster_name, node_type, 'kata-qemu')
-    os.makedirs(folder, exist_ok=True)
-    runtime_class = 'kata-qemu'
-    bench = benchmark.Benchmark(folder, cluster_name, args.resource_group,
-                                args.subscription, runtime_class,
-                                False)
-    bench.run(options, False)
-    
+# Kata settings to sweep for kata-qemu jobs; every combination is a separate
+# result. Settings not listed keep the values of kataconfig.baseline
+# (virtio-fs buffering disabled).
+kata_settings = [
+#     ('virtio_fs_cache', 'none', 'auto', 'always'),
+#     ('allow_direct_io', 'true', 'false'),
+#     ('virtio_fs_cache_size', 0, 1024),
+#     ('virtio_fs_queue_size', 1024),
+]
+
+runtimes = ['runc', 'kata-qemu']
+
+spec = planner.Spec.load(args.spec) if args.spec else planner.Spec(options, runtimes, kata_settings)
+
+def prepare_replica(cluster_name, node_type):
+    """Return the tracker and {runtime class: Benchmark} of a cluster."""
+    tracker = None
+    if not args.fio_server:
+        tracker = kube.JobTracker(kube.proxy_client(cluster_name), cluster_name, view)
+        tracker.start()
+    try:
+        collector = None
+        if args.telemetry:
+            collector = telemetry.Collector(cluster_name, args.telemetry)
+            collector.ensure()
+
+        benches = {}
+        for runtime_class in spec.runtime_classes():
+            folder = os.path.join('data', cluster_name, node_type, runtime_class or 'runc')
+            os.makedirs(folder, exist_ok=True)
+            bench = benchmark.Benchmark(folder, cluster_name, args.resource_group,
+                                        args.subscription, runtime_class,
+                                        False, tracker, args.fio_server, collector,
+                                        spec.kata_settings)
+            bench.prepare()
+            benches[runtime_class] = bench
+    except Exception:
+        if tracker:
+            tracker.stop()
+        raise
+    return tracker, benches
+
+def run_replica(cluster_name, node_type, pool, options):
+    """Join a ready cluster to the pool of its replicas and run jobs from it."""
+    tracker, benches = prepare_replica(cluster_name, node_type)
+    try:
+        pool.join(cluster_name, benches, options, False)
+        print('%s: joined, %d runs to do' % (cluster_name, pool.pending()))
+        scheduler.Scheduler(cluster_name, args.parallel, args.per_node, pool).run()
+    finally:
+        for bench in benches.values():
+            bench.close()
+        if tracker:
+            tracker.stop()
+
+async def run_cluster(provisioner, cluster_name, node_type, pool, options):
+    # Create containerd and kata clusters
+    if provisioner:
+        await provisioner.provision(cluster_name, node_type)
+    await engine.engine.blocking(run_replica, cluster_name, node_type, pool, options)
+
 def run_benchmarks():
-    clusters.set_virtio_fs_buffering(False)
-
-    # iodepths = [
-    #     ('iodepth', 1, 8, 64),
-    #     ('iodepth', 2, 16, 128),
-    #     ('iodepth', 4, 32, 256),
-    # ]
-
-    # idx = 0
-    
-    threads = []
-    for c in clusters.clusters:
-        opts = options.copy()
-        # opts.append(iodepths[idx])
-        t = threading.Thread(target=run_benchmark, args=(*c, opts))
-        threads.append(t)
-
-        # idx += 1
-        # if idx >= len(iodepths):
-        #     idx = 0
-
-    for t in threads:
-        t.start()
-    for t in threads:
-        t.join()
+    """Run the sweep on every cluster, each one as soon as it is ready.
+
+    Clusters of the same node type are replicas of each other and share a
+    ReplicaPool, so a job not started yet is run by whichever replica is
+    free first, and the repeats of a job always run on different replicas.
+    Every cluster is its own engine task, so a failure stops only that cluster.
+    """
+    provisioner = clusters.Provisioner(args) if args.manage_clusters else None
+    replicas = planner.replicas(spec)
+    controller = planner.controller(args)
+
+    # Every cluster holds an engine thread while it runs jobs.
+    engine.engine.configure(threads=sum(len(g) for g in replicas.values()))
+    tasks = {}
+    for node_type, group in replicas.items():
+        pool = scheduler.ReplicaPool(min(args.repeats or len(group), len(group)), controller)
+        for cluster_name in group:
+            tasks[cluster_name] = run_cluster(provisioner, cluster_name, node_type,
+                                              pool, spec.options.copy())
+    clusters.report(engine.run_all(tasks), 'run benchmarks on')
+
+if args.dry_run:
+    # Nothing is created, run or deleted.
+    print(planner.Plan(spec, False, args.parallel, args.resource_group, args.subscription,
+                       args.repeats, planner.controller(args)).describe())
+    sys.exit(0)
 
 run_benchmarks()
-    
+
 # Delete clusters
 if args.manage_clusters:
     clusters.delete_clusters(args)
@@ -0,0 +1,360 @@
+#!/bin/python3
+# Copyright (c) Open Enclave SDK contributors.
+# Licensed under the MIT License
+
+import queue
+import threading
+import traceback
+
+import engine
+import jobspec
+
+def settings_key(bench, job):
+    """Return the kata settings job needs on its node, or None for runc jobs.
+
+    Kata jobs that sweep no settings get an empty key, so that the config
+    recorded with their result cannot change while they run.
+    """
+    if not bench.runtime_class:
+        return None
+    return tuple(sorted(jobspec.JobSpec.parse(job).settings.items()))
+
+def group_key(bench, job):
+    """Return (runtime class, kata settings) of a job; switching either has a cost."""
+    return (bench.runtime_class or '', settings_key(bench, job) or ())
+
+def distance(a, b):
+    """Return the cost of switching from group a to group b."""
+    if a is None:
+        return 0
+    settings = sum(1 for x, y in zip(a[1], b[1]) if x != y) + abs(len(a[1]) - len(b[1]))
+    # A different runtime class costs more than any number of settings.
+    return (a[0] != b[0]) * 1000 + settings
+
+def order(items, key):
+    """Order items so that key changes as rarely and as little as possible.
+
+    Items with the same key are grouped, and each next group is the one
+    closest to the previous, starting with the smallest key.
+    """
+    groups = {}
+    for item in items:
+        groups.setdefault(key(item), []).append(item)
+    ordered = []
+    previous = None
+    while groups:
+        previous = min(groups, key=lambda k: (distance(previous, k), k))
+        ordered += groups.pop(previous)
+    return ordered
+
+def plan(items):
+    """Order (bench, job, silent) items by runtime class, then kata settings."""
+    return order(items, lambda item: group_key(*item[:2]))
+
+
+class Scheduler:
+    """Work queue that runs fio Jobs of one cluster concurrently.
+
+    Up to `concurrency` Jobs are live on the cluster at a time, and at most
+    `per_node` of them are pinned to any one node so that measurements on a
+    node do not interfere with each other.
+
+    Kata jobs that sweep kata settings only share a node with jobs needing
+    the same settings, and a node switches to other settings only once it
+    runs no kata job. Jobs are planned so that nodes switch as rarely as
+    possible, and nodes that already have a job's settings are preferred.
+    """
+
+    def __init__(self, cluster, concurrency=1, per_node=1, pool=None):
+        self.cluster = cluster
+        self.concurrency = concurrency
+        self.per_node = per_node
+        # A ReplicaPool shared with equivalent clusters to take work from.
+        self.pool = pool
+        self.queue = queue.Queue()
+        self.pending = []
+        self.cond = threading.Condition()
+        self.running = {}
+        self.kata_running = {}
+        self.configs = {}
+        self.switches = 0
+
+    def nodes(self):
+        res = engine.kubectl(self.cluster, 'get', 'nodes', '--output=name')
+        if res.returncode:
+            raise RuntimeError('%s: could not list nodes: %s' %
+                               (self.cluster, res.stderr.decode('utf-8')))
+
+        return [n.replace('node/', '') for n in res.stdout.decode('utf-8').split()]
+
+    def submit(self, bench, job, silent=True):
+        self.pending.append((bench, job, silent))
+
+    def acquire_node(self, key=None):
+        with self.cond:
+            while True:
+                free = [n for n in self.running if self.running[n] < self.per_node]
+                if key is not None:
+                    free = [n for n in free
+                            if self.configs.get(n) == key or not self.kata_running[n]]
+                if free:
+                    # Least loaded node, preferring those already configured.
+                    node = min(free, key=lambda n: (key is not None and self.configs.get(n) != key,
+                                                    self.running[n]))
+                    self.running[node] += 1
+                    if key is not None:
+                        if self.configs.get(node) != key:
+                            self.configs[node] = key
+                            self.switches += 1
+                        self.kata_running[node] += 1
+                    return node
+                self.cond.wait()
+
+    def release_node(self, node, key=None):
+        with self.cond:
+            self.running[node] -= 1
+            if key is not None:
+                self.kata_running[node] -= 1
+            self.cond.notify_all()
+
+    def next_item(self):
+        if engine.engine.cancelled.is_set():
+            return None
+        if self.pool:
+            return self.pool.take(self.cluster)
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            return None
+
+    def worker(self):
+        while True:
+            item = self.next_item()
+            if not item:
+                return
+            bench, job, silent = item
+
+            key = settings_key(bench, job)
+            node = self.acquire_node(key)
+            succeeded = False
+            try:
+                succeeded = bench.execute(job, silent, node)
+            except Exception as e:
+                print(e)
+                print(traceback.format_exc())
+            finally:
+                self.release_node(node, key)
+                if self.pool:
+                    self.pool.done(self.cluster, item, succeeded)
+
+    def run(self):
+        self.running = {n: 0 for n in self.nodes()}
+        self.kata_running = {n: 0 for n in self.running}
+        if not self.running:
+            print('%s: No nodes to schedule jobs on.' % self.cluster)
+            return
+
+        for item in plan(self.pending):
+            self.queue.put(item)
+        self.pending = []
+
+        # No point in starting more workers than there are free slots.
+        nworkers = min(self.concurrency, len(self.running) * self.per_node)
+        threads = []
+        for i in range(0, max(nworkers, 1)):
+            t = threading.Thread(target=self.worker)
+            threads.append(t)
+            t.start()
+        for t in threads:
+            t.join()
+        if self.switches:
+            print('%s: %d kata config switches' % (self.cluster, self.switches))
+
+
+class PooledJob:
+    def __init__(self, job, runtime_class, silent):
+        self.job = job
+        self.runtime_class = runtime_class
+        self.silent = silent
+        # cluster -> Benchmark of the job's runtime class on that cluster
+        self.benches = {}
+        # Clusters that have the result, or are running the job.
+        self.claimed = set()
+        self.running = set()
+        self.failed = set()
+
+
+class ReplicaPool:
+    """Shared work queue of equivalent replica clusters.
+
+    Every (job, runtime class) is to be run `repeats` times, each time on a
+    different replica. Results a replica already has count as repeats.
+    Replicas join the pool whenever they are ready, and the Schedulers of
+    the replicas take the next job they have not run yet from the pool
+    whenever they have a free slot, so fast or lightly loaded replicas take
+    over work slower ones have not started, and the sweep ends when the work
+    runs out rather than when the slowest replica is done with its share. A
+    failed run is handed to another replica.
+
+    With a controller (adaptive.Controller, knee.Controller), the pool runs
+    every job once on any replica, and the controller decides which runs
+    make up a configuration: it gives the first runs of each, and adds runs
+    whenever all runs of a configuration so far are done, until it has
+    what it needs.
+    """
+
+    def __init__(self, repeats, controller=None):
+        self.repeats = 1 if controller else repeats
+        self.controller = controller
+        self.cond = threading.Condition()
+        self.jobs = []
+        self.index = {}
+        # (runtime class, controller.config(job)) -> PooledJobs of a configuration
+        self.configs = {}
+        self.complete = set()
+        # Configurations whose controller is deciding on more runs.
+        self.extending = set()
+
+    def add(self, job, runtime_class, benches, silent, results):
+        """Add a job unless it is known.
+
+        benches maps clusters to Benchmarks, and results maps them to the
+        job's cached result there; see cached.
+        """
+        p = self.index.get((runtime_class, job.digest))
+        if not p:
+            p = self.index[(runtime_class, job.digest)] = PooledJob(job, runtime_class, silent)
+            self.jobs.append(p)
+            if self.controller:
+                self.configs.setdefault((runtime_class, self.controller.config(job)), []).append(p)
+        for cluster, bench in benches.items():
+            p.benches[cluster] = bench
+            result = results.get(cluster)
+            if result:
+                p.claimed.add(cluster)
+                if not silent:
+                    bench.log(job, result)
+        return p
+
+    @staticmethod
+    def cached(job, benches):
+        """Return {cluster: cached result or None} of job.
+
+        Every lookup reads results.log, so this is called without holding
+        the pool's lock, which would stop every other replica meanwhile.
+        """
+        return {cluster: bench.cache_lookup(job) for cluster, bench in benches.items()}
+
+    def join(self, cluster, benches, options, silent=True):
+        """Add a replica; benches maps each runtime class to its Benchmark on cluster."""
+        runs = []
+        for runtime_class, bench in benches.items():
+            for job in bench.jobs(options or bench.default_options()):
+                for run in self.controller.initial(job) if self.controller else [job]:
+                    runs.append((run, runtime_class, self.cached(run, {cluster: bench})))
+        with self.cond:
+            for run, runtime_class, results in runs:
+                self.add(run, runtime_class, {cluster: benches[runtime_class]}, silent, results)
+        # Runs added for earlier replicas can run here too. More may be added
+        # while their results are looked up.
+        while True:
+            with self.cond:
+                missing = [p for p in self.jobs
+                           if p.runtime_class in benches and cluster not in p.benches]
+            if not missing:
+                break
+            found = [self.cached(p.job, {cluster: benches[p.runtime_class]}) for p in missing]
+            with self.cond:
+                for p, results in zip(missing, found):
+                    self.add(p.job, p.runtime_class, {cluster: benches[p.runtime_class]},
+                             p.silent, results)
+        if self.controller:
+            with self.cond:
+                configs = list(self.configs)
+            for config in configs:
+                self.extend(config)
+        with self.cond:
+            self.plan()
+            self.cond.notify_all()
+
+    def plan(self):
+        self.jobs = order(self.jobs, lambda p: group_key(next(iter(p.benches.values())), p.job))
+
+    def finished(self, p):
+        return not p.running and not any(self.can_take(p, c) for c in p.benches)
+
+    def extend(self, config):
+        """Add runs of a configuration whose runs are all done if it needs more.
+
+        The controller reads the results of the runs, so it is asked
+        without holding the lock; meanwhile take() waits rather than
+        letting a replica stop.
+        """
+        with self.cond:
+            runs = self.configs[config]
+            if (config in self.complete or config in self.extending
+                    or not all(self.finished(p) for p in runs)):
+                return
+            self.extending.add(config)
+            first = runs[0]
+            benches = dict(first.benches)
+            jobs = [p.job for p in runs]
+        found = None
+        try:
+            added = self.controller.more(jobs, benches.values(), len(benches))
+            found = [(run, self.cached(run, benches)) for run in added]
+            if not found and not first.silent:
+                print('%s: %s %s' % (','.join(sorted(benches)), first.job,
+                                     self.controller.describe(jobs, benches.values())))
+        finally:
+            with self.cond:
+                self.extending.discard(config)
+                if found:
+                    for run, results in found:
+                        self.add(run, config[0], benches, first.silent, results)
+                    self.plan()
+                elif found is not None:
+                    self.complete.add(config)
+                self.cond.notify_all()
+
+    def can_take(self, p, cluster):
+        return (cluster in p.benches and cluster not in p.claimed and cluster not in p.failed
+                and len(p.claimed) < self.repeats)
+
+    def take(self, cluster):
+        """Return the next (bench, job, silent) for cluster, or None if there is none.
+
+        While a job cluster could still run is running elsewhere, and may
+        fail there, this waits instead of returning None.
+        """
+        with self.cond:
+            while True:
+                waiting = False
+                for p in self.jobs:
+                    if self.can_take(p, cluster):
+                        p.claimed.add(cluster)
+                        p.running.add(cluster)
+                        return (p.benches[cluster], p.job, p.silent)
+                    waiting = waiting or bool(p.running)
+                if not waiting and not self.extending:
+                    return None
+                self.cond.wait()
+
+    def done(self, cluster, item, succeeded):
+        bench, job, _ = item
+        with self.cond:
+            # Runtime classes can share one JobSpec object, so the job alone
+            # does not tell which entry finished.
+            p = self.index[(bench.runtime_class, job.digest)]
+            p.running.discard(cluster)
+            if not succeeded:
+                # Another replica may still run it.
+                p.claimed.discard(cluster)
+                p.failed.add(cluster)
+            self.cond.notify_all()
+        if self.controller:
+            self.extend((p.runtime_class, self.controller.config(p.job)))
+
+    def pending(self):
+        with self.cond:
+            return sum(max(0, self.repeats - len(p.claimed)) for p in self.jobs)
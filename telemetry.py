@@ -0,0 +1,208 @@
+#!/bin/python3
+# Copyright (c) Open Enclave SDK contributors.
+# Licensed under the MIT License
+
+import json
+import subprocess
+import threading
+import uuid
+import zlib
+
+import engine
+import nodecmd
+
+# Ticks per second of the utime/stime fields of /proc/<pid>/stat.
+clock_ticks = 100
+
+# Processes whose CPU time is sampled, by the prefix of their comm.
+processes = ('virtiofsd', 'qemu')
+
+# Devices that never hold benchmark data.
+ignored_devices = ('loop', 'ram', 'sr')
+
+# Prints one sample every interval seconds until it is killed through its
+# pidfile or max_samples were printed. Every sample starts with a line
+# holding the uptime and is followed by raw /proc lines with a prefix.
+sample_script = """
+echo $$ > %(pidfile)s
+trap 'rm -f %(pidfile)s' EXIT
+n=0
+while [ $n -lt %(max_samples)d ]; do
+  echo "@ $(cut -d' ' -f1 /proc/uptime)" || exit 0
+  head -1 /proc/stat
+  sed 's/^/disk /' /proc/diskstats
+  for f in cpu io memory; do
+    [ -r /proc/pressure/$f ] && sed "s/^/psi $f /" /proc/pressure/$f
+  done
+  for p in /proc/[0-9]*; do
+    c=$(cat $p/comm 2>/dev/null)
+    case "$c" in %(patterns)s) echo "proc $c ${p#/proc/} $(cut -d' ' -f14,15 $p/stat)";; esac
+  done
+  n=$((n + 1))
+  sleep %(interval)s
+done
+"""
+
+def parse(output):
+    """Parse the output of sample_script into per-counter series.
+
+    Returns {'t': [uptime], 'cpu': [[user, nice, system, idle, iowait, irq,
+    softirq, steal]], 'disk': {device: [[reads, sectors read, writes,
+    sectors written, io ms, weighted io ms]]}, 'psi': {'io some': [total us]},
+    'proc': {'qemu-system-x86 1234': [ticks]}}. Series of devices and
+    processes have None where they were not seen.
+    """
+    samples = {'t': [], 'cpu': [], 'disk': {}, 'psi': {}, 'proc': {}}
+
+    def put(series, key, value):
+        values = series.setdefault(key, [])
+        values.extend([None] * (len(samples['t']) - 1 - len(values)))
+        values.append(value)
+
+    for line in output.splitlines():
+        fields = line.split()
+        if not fields:
+            continue
+        if fields[0] == '@':
+            samples['t'].append(float(fields[1]))
+        elif not samples['t']:
+            continue
+        elif fields[0] == 'cpu':
+            samples['cpu'].append([int(v) for v in fields[1:9]])
+        elif fields[0] == 'disk' and len(fields) >= 15:
+            device = fields[3]
+            if not device.startswith(ignored_devices):
+                put(samples['disk'], device, [int(fields[i]) for i in (4, 6, 8, 10, 13, 14)])
+        elif fields[0] == 'psi':
+            total = [f for f in fields if f.startswith('total=')]
+            if total:
+                put(samples['psi'], '%s %s' % (fields[1], fields[2]), int(total[0][6:]))
+        elif fields[0] == 'proc' and len(fields) == 5:
+            put(samples['proc'], '%s %s' % (fields[1], fields[2]), int(fields[3]) + int(fields[4]))
+
+    # A sample cut short by the end of the exec is dropped.
+    n = len(samples['cpu'])
+    samples['t'] = samples['t'][:n]
+    for series in (samples['disk'], samples['psi'], samples['proc']):
+        for key, values in series.items():
+            series[key] = (values + [None] * n)[:n]
+    return samples
+
+def encode(samples):
+    return zlib.compress(json.dumps(samples, separators=(',', ':')).encode('utf-8'), 9)
+
+def decode(data):
+    return json.loads(zlib.decompress(data).decode('utf-8'))
+
+def delta(values):
+    """Return the increase of a counter between its first and last sample."""
+    seen = [v for v in values if v is not None]
+    return seen[-1] - seen[0] if len(seen) > 1 else 0
+
+def summary(data):
+    """Return the telemetry columns of a result's encoded samples."""
+    if not data:
+        return {}
+    samples = decode(data)
+    if len(samples['t']) < 2:
+        return {}
+    elapsed = samples['t'][-1] - samples['t'][0]
+
+    fields = {}
+    cpu = [b - a for a, b in zip(samples['cpu'][0], samples['cpu'][-1])]
+    total = sum(cpu)
+    if total:
+        fields['host cpu busy (%)'] = round(100.0 * (total - cpu[3] - cpu[4]) / total, 2)
+        fields['host iowait (%)'] = round(100.0 * cpu[4] / total, 2)
+        fields['host steal (%)'] = round(100.0 * cpu[7] / total, 2)
+
+    for name, values in sorted(samples['psi'].items()):
+        fields['psi %s (%%)' % name] = round(100.0 * delta(values) / (elapsed * 1e6), 2)
+
+    for prefix in processes:
+        ticks = sum(delta(v) for k, v in samples['proc'].items() if k.startswith(prefix))
+        fields['%s cpu (%%)' % prefix] = round(100.0 * ticks / clock_ticks / elapsed, 2)
+
+    # The busiest device is the one the benchmark used.
+    busiest = None
+    for device, values in samples['disk'].items():
+        seen = [v for v in values if v is not None]
+        if len(seen) > 1 and (not busiest or seen[-1][4] - seen[0][4] > busiest[4]):
+            busiest = [b - a for a, b in zip(seen[0], seen[-1])]
+    if busiest:
+        fields['host disk util (%)'] = round(100.0 * busiest[4] / (elapsed * 1000), 2)
+        fields['host disk queue'] = round(busiest[5] / (elapsed * 1000), 2)
+    return fields
+
+
+def summary_columns():
+    """Return every column summary() can return."""
+    return (['host cpu busy (%)', 'host iowait (%)', 'host steal (%)']
+            + ['psi %s %s (%%)' % (f, kind) for f in ('cpu', 'io', 'memory') for kind in ('some', 'full')]
+            + ['%s cpu (%%)' % p for p in processes]
+            + ['host disk util (%)', 'host disk queue'])
+
+
+class Sampler:
+    """Samples counters of one node through its telemetry pod until stopped."""
+
+    def __init__(self, cluster, pod, interval, max_samples):
+        self.cluster = cluster
+        self.pod = pod
+        self.pidfile = '/tmp/telemetry-%s.pid' % uuid.uuid4().hex[:12]
+        script = sample_script % {'interval': interval, 'max_samples': max_samples,
+                                  'patterns': '|'.join(p + '*' for p in processes),
+                                  'pidfile': self.pidfile}
+        self.proc = subprocess.Popen([engine.kubectl_command, '--context=' + cluster, 'exec', pod,
+                                      '--', 'sh', '-c', script],
+                                     stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self.output = []
+        self.reader = threading.Thread(target=self.read, daemon=True)
+        self.reader.start()
+
+    def read(self):
+        for line in self.proc.stdout:
+            self.output.append(line.decode('utf-8', errors='replace'))
+
+    def stop(self):
+        """Stop sampling and return the encoded samples."""
+        # kubectl exec going away does not end the script on the node, where
+        # it would go on sampling during the next job.
+        res = engine.kubectl(self.cluster, 'exec', self.pod, '--', 'sh', '-c',
+                             '[ -f %(f)s ] && kill $(cat %(f)s); rm -f %(f)s' % {'f': self.pidfile})
+        if res.returncode:
+            print('%s: could not stop sampler in %s: %s' % (
+                self.cluster, self.pod, res.stderr.decode('utf-8')))
+        self.proc.terminate()
+        self.proc.wait()
+        self.reader.join()
+        return encode(parse(''.join(self.output)))
+
+
+class Collector:
+    """Node telemetry of one cluster, collected while fio jobs run.
+
+    For every job a sampler is started in the node agent pod (see
+    nodecmd.NodeAgent) on the job's node. It shares the host PID namespace,
+    so it reads the host's /proc/stat, /proc/diskstats, /proc/pressure/* and
+    the CPU time of virtiofsd and qemu processes every `interval` seconds.
+    """
+
+    def __init__(self, cluster, interval=2, max_duration=3600):
+        self.cluster = cluster
+        self.interval = interval
+        self.max_samples = max(1, int(max_duration / interval))
+        self.agent = nodecmd.agent(cluster)
+
+    def ensure(self):
+        self.agent.ensure()
+
+    def start(self, node):
+        """Start sampling node; returns a Sampler, or None if that is not possible."""
+        if not node:
+            return None
+        try:
+            return Sampler(self.cluster, self.agent.pod(node), self.interval, self.max_samples)
+        except Exception as e:
+            print(e)
+            return None
@@ -0,0 +1,40 @@
+#!/bin/python3
+# Copyright (c) Open Enclave SDK contributors.
+# Licensed under the MIT License
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import benchmark
+import jobspec
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.job = jobspec.JobSpec.parse('fio --bs=4k --iodepth=16')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def bench(self):
+        bench = benchmark.Benchmark(self.dir, 'c1', 'rg', 'sub', None, False)
+        bench.load_cache()
+        return bench
+
+    def test_corrupt_record_is_a_miss(self):
+        self.bench().cache_store(self.job, {'output': '{}', 'timings': {}})
+        path = os.path.join(self.dir, 'results.log')
+        with open(path, 'r+b') as f:
+            f.seek(-2, os.SEEK_END)
+            f.write(b'\0\0')
+
+        bench = self.bench()
+        self.assertIsNone(bench.cache_lookup(self.job))
+        bench.cache_store(self.job, {'output': '{}', 'timings': {}})
+        self.assertEqual(self.bench().cache_lookup(self.job)['output'], '{}')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/bin/python3
+# Copyright (c) Open Enclave SDK contributors.
+# Licensed under the MIT License
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import clusters
+import engine
+
+# Logs every call and fails those that name a cluster with 'fail-<word>'
+# in it, where word is an argument of the call.
+stub = """#!/bin/sh
+echo "$0 $*" >> "%(log)s"
+for a in "$@"; do
+  case "$*" in *fail-$a*) exit 1;; esac
+done
+case "$*" in *"get nodes"*) echo node/aks-nodepool1-0;; esac
+exit 0
+"""
+
+class Args:
+    resource_group = 'rg'
+    subscription = 'sub'
+    location = 'loc'
+
+
+class RecordingProvisioner(clusters.Provisioner):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.order = {}
+
+    def reach(self, name, stage):
+        super().reach(name, stage)
+        self.order.setdefault(name, []).append(stage)
+
+
+class ProvisionerTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir(self.dir)
+        self.log = os.path.join(self.dir, 'calls')
+        self.commands = (engine.az_command, engine.kubectl_command)
+        for name in ('az', 'kubectl'):
+            path = os.path.join(self.dir, name)
+            with open(path, 'w') as f:
+                f.write(stub % {'log': self.log})
+            os.chmod(path, 0o755)
+        engine.az_command = os.path.join(self.dir, 'az')
+        engine.kubectl_command = os.path.join(self.dir, 'kubectl')
+
+    def tearDown(self):
+        engine.az_command, engine.kubectl_command = self.commands
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+
+    def calls(self, name):
+        """Return the first words of the az and kubectl calls for cluster name, in order."""
+        calls = []
+        with open(self.log) as f:
+            for line in f:
+                words = line.split()
+                if name in words or '--context=' + name in words:
+                    words = [os.path.basename(words[0])] + [w for w in words[1:]
+                                                            if not w.startswith('--context=')]
+                    calls.append(' '.join(words[:3]))
+        return calls
+
+    def provision(self, names, vm_size='Standard_L8s_v3'):
+        provisioner = RecordingProvisioner(Args(), True)
+        results = engine.run_all({n: provisioner.provision(n, vm_size) for n in names})
+        return provisioner, results
+
+    def test_stages_in_order(self):
+        provisioner, results = self.provision(['c1', 'c2'])
+        self.assertEqual(engine.failed(results), [])
+        for name in ('c1', 'c2'):
+            order = provisioner.order[name]
+            self.assertEqual(order[:2], ['created', 'credentials'])
+            self.assertEqual(sorted(order[2:5]), ['kata', 'labelled', 'storage'])
+            self.assertEqual(order[5:], ['ready'])
+            self.assertEqual(provisioner.reached[name], 'ready')
+            calls = self.calls(name)
+            self.assertEqual(calls[:2], ['az aks create', 'az aks get-credentials'])
+            self.assertIn('kubectl label --overwrite', calls)
+            self.assertTrue(os.path.isfile('cluster_%s.yaml' % name))
+
+    def test_failure_stays_with_its_cluster(self):
+        names = ['c1', 'fail-create', 'fail-wait', 'c2']
+        provisioner, results = self.provision(names)
+        self.assertEqual(engine.failed(results), ['fail-create', 'fail-wait'])
+        self.assertEqual(clusters.report(results, 'create'), ['c1', 'c2'])
+        for name in ('c1', 'c2'):
+            self.assertEqual(provisioner.reached[name], 'ready')
+        self.assertNotIn('fail-create', provisioner.reached)
+        self.assertNotIn('ready', provisioner.order['fail-wait'])
+        # Its other stages still finish.
+        self.assertIn('storage', provisioner.order['fail-wait'])
+        self.assertEqual(self.calls('fail-create'), ['az aks create'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,24 @@
+#!/bin/python3
+# Copyright (c) Open Enclave SDK contributors.
+# Licensed under the MIT License
+
+import unittest
+
+import jobspec
+
+class JobSpecTest(unittest.TestCase):
+    def test_compound_sizes(self):
+        self.assertEqual(jobspec.normalize_size('4k,8k'), '4096,8192')
+        self.assertEqual(jobspec.normalize_size('4k-16k'), '4096-16384')
+        self.assertEqual(jobspec.normalize_size('4k/50:8k/50'), '4096/50:8192/50')
+        self.assertEqual(jobspec.normalize_size('4K/30:64k/70,1m'), '4096/30:65536/70,1048576')
+
+    def test_same_split_same_key(self):
+        a = jobspec.JobSpec.parse('fio --bssplit=4k/50:8k/50 --bsrange=4k-16k --ba=4k')
+        b = jobspec.JobSpec.parse('fio --bssplit=4096/50:8192/50 --bsrange=4096-16384 --ba=4096')
+        self.assertEqual(a.key, b.key)
+        self.assertEqual(a.digest, b.digest)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+#!/bin/python3
+# Copyright (c) Open Enclave SDK contributors.
+# Licensed under the MIT License
+
+import http.server
+import json
+import queue
+import threading
+import unittest
+import urllib.parse
+
+import kube
+
+class FakeApiServer(http.server.ThreadingHTTPServer):
+    """Serves Job and Pod listings, watch events and pod logs from memory."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeApiHandler)
+        self.events = {'jobs': queue.Queue(), 'pods': queue.Queue()}
+        self.logs = {}
+        self.log_lines = {}
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def event(self, kind, type, obj):
+        self.events[kind].put({'type': type, 'object': obj})
+
+    def stop(self):
+        self.stopping.set()
+        self.shutdown()
+        self.server_close()
+
+
+class FakeApiHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def stream(self, lines):
+        self.send_response(200)
+        self.end_headers()
+        for line in lines:
+            if line is None:
+                continue
+            self.wfile.write(line.encode('utf-8'))
+            self.wfile.flush()
+
+    def events(self, kind):
+        while not self.server.stopping.is_set():
+            try:
+                yield json.dumps(self.server.events[kind].get(timeout=0.05)) + '\n'
+            except queue.Empty:
+                yield None
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        params = urllib.parse.parse_qs(url.query)
+        parts = url.path.split('/')
+        if parts[-1] == 'log':
+            pod = parts[-2]
+            if params.get('follow'):
+                self.stream(self.server.log_lines.get(pod, []))
+            else:
+                self.stream([self.server.logs.get(pod, '')])
+        elif params.get('watch'):
+            self.stream(self.events(parts[-1]))
+        else:
+            self.stream([json.dumps({'items': [], 'metadata': {'resourceVersion': '1'}})])
+
+
+def job(name):
+    return {'metadata': {'name': name, 'creationTimestamp': '2024-01-01T00:00:00Z'}}
+
+def pod(name, state, event_time='2024-01-01T00:00:01Z'):
+    return {'metadata': {'name': name + '-pod', 'labels': {'job-name': name}},
+            'status': {'conditions': [{'type': 'PodScheduled', 'status': 'True',
+                                       'lastTransitionTime': event_time}],
+                       'containerStatuses': [{'state': state}]}}
+
+running = {'running': {'startedAt': '2024-01-01T00:00:02Z'}}
+terminated = {'terminated': {'startedAt': '2024-01-01T00:00:02Z',
+                             'finishedAt': '2024-01-01T00:01:02Z', 'exitCode': 0}}
+
+
+class JobTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeApiServer()
+        self.tracker = kube.JobTracker(kube.ApiClient(self.server.url), 'test')
+        self.tracker.start()
+
+    def tearDown(self):
+        self.tracker.stop()
+        self.server.stop()
+
+    def test_finished_job(self):
+        self.tracker.track('fio-1')
+        self.server.logs['fio-1-pod'] = '{"jobs": []}'
+        self.server.event('jobs', 'ADDED', job('fio-1'))
+        self.server.event('pods', 'MODIFIED', pod('fio-1', running))
+        self.server.event('pods', 'MODIFIED', pod('fio-1', terminated))
+        tracked = self.tracker.wait('fio-1', timeout=5)
+        self.assertIsNone(tracked.error)
+        self.assertEqual(tracked.logs, '{"jobs": []}')
+        self.assertEqual(set(tracked.timings), {'job_created', 'pod_scheduled',
+                                                'container_started', 'container_finished'})
+        self.assertEqual(tracked.timings['container_finished'] - tracked.timings['job_created'], 62)
+
+        deleted = pod('fio-1', terminated)
+        deleted['metadata']['deletionTimestamp'] = '2024-01-01T00:01:05Z'
+        self.server.event('pods', 'DELETED', deleted)
+        timings = self.tracker.forget('fio-1', timeout=5).timings
+        self.assertEqual(timings['pod_deleted'] - timings['container_finished'], 3)
+        self.assertIsNone(self.tracker.get('fio-1'))
+
+    def test_pod_that_cannot_start_fails(self):
+        self.tracker.track('fio-2')
+        self.server.event('pods', 'MODIFIED',
+                          pod('fio-2', {'waiting': {'reason': 'ErrImagePull', 'message': 'no'}}))
+        tracked = self.tracker.wait('fio-2', timeout=5)
+        self.assertEqual(tracked.error, 'ErrImagePull: no')
+
+    def test_fio_error_fails_while_running(self):
+        self.tracker.track('fio-3')
+        self.server.log_lines['fio-3-pod'] = ['fio: pid=12, err=28/file:io_u.c:1, '
+                                              'func=io_u error, error=No space left on device\n']
+        self.server.event('pods', 'MODIFIED', pod('fio-3', running))
+        tracked = self.tracker.wait('fio-3', timeout=5)
+        self.assertTrue(tracked.error.startswith('fio error'), tracked.error)
+
+    def test_stop_ends_the_watches(self):
+        self.tracker.stop()
+        self.server.stop()
+        for t in self.tracker.threads:
+            t.join(5)
+            self.assertFalse(t.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
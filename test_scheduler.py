@@ -0,0 +1,176 @@
+#!/bin/python3
+# Copyright (c) Open Enclave SDK contributors.
+# Licensed under the MIT License
+
+import random
+import threading
+import time
+import unittest
+
+import adaptive
+import jobspec
+import knee
+import scheduler
+
+output = '{"jobs":[{"read":{"total_ios":1,"bw":%d,"iops":%f,"bw_bytes":%d,"clat_ns":{"mean":%f}}}]}'
+
+def result(iops, latency_us=1000.0):
+    return {'output': output % (iops, iops, iops * 1000, latency_us * 1000), 'timings': {}}
+
+
+class FakeBench:
+    """Stands in for benchmark.Benchmark; results are kept in memory."""
+
+    def __init__(self, cluster, runtime_class, jobs, measure=None, fails=()):
+        self.cluster = cluster
+        self.runtime_class = runtime_class
+        self.job_strings = jobs
+        self.measure = measure or (lambda job: result(1000))
+        self.fails = fails
+        self.store = {}
+        self.ran = []
+        self.lock = threading.Lock()
+
+    def jobs(self, options):
+        return [jobspec.JobSpec.parse(j) for j in self.job_strings]
+
+    def default_options(self):
+        return []
+
+    def cache_lookup(self, job):
+        return self.store.get(jobspec.key(job))
+
+    def log(self, job, result):
+        pass
+
+    def execute(self, job, silent=True, node=None):
+        time.sleep(0.005)
+        with self.lock:
+            self.ran.append(job)
+        if any(f in str(job) for f in self.fails):
+            return False
+        self.store[jobspec.key(job)] = self.measure(job)
+        return True
+
+    def close(self):
+        pass
+
+
+class FakeScheduler(scheduler.Scheduler):
+    def nodes(self):
+        return ['node-1', 'node-2']
+
+
+def run_replicas(pool, benches, timeout=10):
+    """Join every cluster of {cluster: {runtime class: bench}} and run it; return unfinished."""
+    def run(cluster):
+        pool.join(cluster, benches[cluster], None)
+        FakeScheduler(cluster, concurrency=2, per_node=1, pool=pool).run()
+
+    threads = {c: threading.Thread(target=run, args=(c,), daemon=True) for c in benches}
+    for t in threads.values():
+        t.start()
+    deadline = time.time() + timeout
+    for t in threads.values():
+        t.join(max(0, deadline - time.time()))
+    return [c for c, t in threads.items() if t.is_alive()]
+
+
+class ReplicaPoolTest(unittest.TestCase):
+    jobs = ['fio --bs=4k --iodepth=16', 'fio --bs=64k --iodepth=16']
+
+    def test_runtime_classes_sharing_jobs_finish(self):
+        # Without kata settings, runc and kata jobs parse to the same JobSpec.
+        benches = {c: {rc: FakeBench(c, rc, self.jobs) for rc in ('', 'kata-qemu')}
+                   for c in ('c1', 'c2', 'c3')}
+        pool = scheduler.ReplicaPool(2)
+        self.assertEqual(run_replicas(pool, benches), [])
+        for rc in ('', 'kata-qemu'):
+            for job in self.jobs:
+                ran = [c for c in benches if job in [str(j) for j in benches[c][rc].ran]]
+                self.assertEqual(len(ran), 2, (rc, job, ran))
+        self.assertEqual(pool.pending(), 0)
+
+    def lookups_under_lock(self, controller=None):
+        """Run the jobs on two replicas; return the jobs looked up while the pool was locked."""
+        pool = scheduler.ReplicaPool(2, controller)
+        locked = []
+
+        class Bench(FakeBench):
+            def cache_lookup(self, job):
+                # Other replicas must be able to take the pool's lock meanwhile.
+                def try_lock():
+                    if pool.cond.acquire(timeout=1):
+                        pool.cond.release()
+                    else:
+                        locked.append(job)
+
+                t = threading.Thread(target=try_lock)
+                t.start()
+                t.join()
+                return super().cache_lookup(job)
+
+        benches = {c: {'': Bench(c, '', self.jobs)} for c in ('c1', 'c2')}
+        self.assertEqual(run_replicas(pool, benches), [])
+        return locked
+
+    def test_cache_lookups_leave_the_pool_free(self):
+        self.assertEqual(self.lookups_under_lock(), [])
+
+    def test_controller_reads_leave_the_pool_free(self):
+        self.assertEqual(self.lookups_under_lock(adaptive.Controller(0.05, 0.9, 4)), [])
+
+    def test_failed_run_moves_to_another_replica(self):
+        benches = {'c1': {'': FakeBench('c1', '', self.jobs, fails=('64k',))},
+                   'c2': {'': FakeBench('c2', '', self.jobs)}}
+        pool = scheduler.ReplicaPool(1)
+        self.assertEqual(run_replicas(pool, benches), [])
+        self.assertIsNotNone(benches['c2'][''].cache_lookup(self.jobs[1]))
+
+    def test_cached_results_count_as_repeats(self):
+        benches = {c: {'': FakeBench(c, '', self.jobs)} for c in ('c1', 'c2')}
+        for c in benches:
+            benches[c][''].store[jobspec.key(self.jobs[0])] = result(1000)
+        pool = scheduler.ReplicaPool(2)
+        self.assertEqual(run_replicas(pool, benches), [])
+        for c in benches:
+            self.assertEqual([str(j) for j in benches[c][''].ran], [self.jobs[1]])
+
+    def test_adaptive_runs_noisy_configurations_more(self):
+        rng = random.Random(1)
+
+        def measure(job):
+            noise = 0.01 if '--bs=4k' in str(job) else 0.3
+            return result(1000 * (1 + rng.uniform(-noise, noise)))
+
+        benches = {c: {'': FakeBench(c, '', self.jobs, measure)} for c in ('c1', 'c2')}
+        controller = adaptive.Controller(0.05, 0.9, 12)
+        pool = scheduler.ReplicaPool(2, controller)
+        self.assertEqual(run_replicas(pool, benches), [])
+        runs = {j: sum(1 for c in benches for r in benches[c][''].ran if str(r).startswith(j))
+                for j in self.jobs}
+        self.assertEqual(runs[self.jobs[0]], controller.min_repeats)
+        self.assertEqual(runs[self.jobs[1]], 12)
+
+    def test_knee_search(self):
+        def measure(job):
+            depth = int(job.get('iodepth'))
+            saturation = 12 if '--bs=4k' in str(job) else 70
+            iops = 1000 * min(depth, saturation)
+            return result(iops, depth / iops * 1e6)
+
+        benches = {c: {'': FakeBench(c, '', self.jobs, measure)} for c in ('c1', 'c2')}
+        controller = knee.Controller(0.1)
+        pool = scheduler.ReplicaPool(1, controller)
+        self.assertEqual(run_replicas(pool, benches), [])
+        stores = [benches[c][''] for c in benches]
+        for job, expected in zip(self.jobs, (16, 64)):
+            spec = jobspec.parse(job)
+            self.assertEqual(controller.knee([spec], stores), expected)
+            runs = sum(1 for b in stores for r in b.ran if jobspec.with_option(r, 'iodepth', 1)
+                       == jobspec.with_option(spec, 'iodepth', 1))
+            self.assertLess(runs, len(controller.depths))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,36 +2,105 @@
 # Copyright (c) Open Enclave SDK contributors.
 # Licensed under the MIT License
 
+import argparse
+import collections
+import concurrent.futures
+import csv
+import hashlib
 import os
-import math
 import pandas as pd
 import pathlib
 import pickle
-import re
 import sys
+import zlib
 
-# Load all caches
-caches = [ (p.parent, pickle.loads(p.read_bytes()))
-           for p in sorted(pathlib.Path('.').rglob('cache.pickle'))]
-
-read_re = re.compile(r'read: IOPS=(\d+\.?\d*)(k?), BW=(\d+\.?\d*)(MiB/s|KiB/s|B/s)')
-write_re = re.compile(r'write: IOPS=(\d+\.?\d*)(k?), BW=(\d+\.?\d*)(MiB/s|KiB/s|B/s)')
-
-def get_iops_bw(m):
-    iops = float(m[0])
-    if m[1] == 'k':
-        iops *= 1000
-    iops = math.ceil(iops)
-    bw = float(m[2])
-    if m[3] == 'KiB/s':
-         bw /= 1024.0
-    elif m[3] == 'B/s':
-         bw /= (1024.0 * 1024.0)
-    bw *= 1.024
-    bw_raw = m[2] + m[3]
-    return (bw_raw, iops, bw)
-
-def add_job_to_table(job, output, common_fields, table):
+import fioresult
+import histogram
+import jobspec
+import resultstore
+import telemetry
+
+# Parquet output is optional.
+try:
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+class Columns:
+    """Column-oriented table that grows one job at a time.
+
+    Rows are never materialized as dicts; every column is a list, and a
+    column first seen after some rows were added is back-filled with None.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.length = 0
+
+    def extend(self, constant, varying, n):
+        """Append n rows: constant maps columns to one value, varying to n values."""
+        for c, v in constant.items():
+            self.column(c).extend([v] * n)
+        for c, v in varying.items():
+            self.column(c).extend(v)
+        self.length += n
+        for c in self.data.values():
+            if len(c) < self.length:
+                c.extend([None] * (self.length - len(c)))
+
+    def column(self, c):
+        if c not in self.data:
+            self.data[c] = [None] * self.length
+        return self.data[c]
+
+    def take(self, column, keep):
+        """Return a copy with only the rows whose column value is in keep."""
+        rows = [i for i, v in enumerate(self.data.get(column, [])) if v in keep]
+        out = Columns()
+        out.data = {c: [v[i] for i in rows] for c, v in self.data.items()}
+        out.length = len(rows)
+        return out
+
+    @classmethod
+    def concat(cls, parts):
+        out = cls()
+        for p in parts:
+            for c in p.data:
+                out.column(c)
+            for c, v in out.data.items():
+                v.extend(p.data[c] if c in p.data else [None] * p.length)
+            out.length += p.length
+        return out
+
+# Startup and teardown overhead columns, as (column, from event, to event).
+# For kata-qemu "pod start" includes the VM boot and virtio-fs setup.
+timing_columns = [
+    ('schedule (s)', 'job_created', 'pod_scheduled'),
+    ('pod start (s)', 'pod_scheduled', 'container_started'),
+    ('fio start (s)', 'container_started', 'fio_started'),
+    ('fio run (s)', 'fio_started', 'fio_finished'),
+    ('teardown (s)', 'container_finished', 'pod_deleted'),
+]
+
+def result_columns():
+    """Return the columns that hold results rather than describe the job.
+
+    Rows that differ only in them, or in the fio job number and the
+    repeat, are runs of the same configuration.
+    """
+    return (set(fioresult.json_columns) - {'op'} | {'job', 'repeat'}
+            | set(c for c, _, _ in timing_columns) | set(telemetry.summary_columns()))
+
+def timing_fields(timings):
+    fields = {}
+    for column, start, end in timing_columns:
+        if start in timings and end in timings:
+            fields[column] = round(timings[end] - timings[start], 3)
+    return fields
+
+def add_job_to_table(job, result, common_fields, table):
     to_remove = ['--', 'fio', 'group_reporting']
     for s in to_remove:
         job = job.replace(s, '')
@@ -39,53 +108,339 @@ def add_job_to_table(job, output, common_fields, table):
     row = common_fields.copy()
     for option in job.split():
         parts = option.split('=')
-        row[parts[0]] = parts[1] if len(parts) == 2 else 1
-
-    reads = re.findall(read_re, output)
-    row['op'] = 'read'
-    for idx, read in enumerate(reads):
-        row['BW'], row['IOPS'], row['BW (MB/s)'] = get_iops_bw(read)
-        if len(reads) > 1:
-            row['job'] = idx
-        table.append(row.copy())
-
-    writes = re.findall(write_re, output)
-    row['op'] = 'write'
-    for idx, write in enumerate(writes):
-        row['BW'], row['IOPS'], row['BW (MB/s)'] = get_iops_bw(write)
-        if len(writes) > 1:
-            row['job'] = idx
-        table.append(row.copy())
-
-
-    if not reads and not writes:
-        print("Error parsing the following.")
+        if parts[0] in jobspec.ignored:
+            continue
+        # Kata settings (+name=value) become columns like fio options.
+        row[parts[0].lstrip('+')] = parts[1] if len(parts) == 2 else 1
+    config = resultstore.kata_config(result)
+    if config:
+        row['kata config'] = config['checksum'][:12]
+    row.update(timing_fields(resultstore.timings(result)))
+    row.update(telemetry.summary(resultstore.telemetry(result)))
+
+    output = resultstore.output(result)
+    varying = fioresult.metrics(output)
+    n = len(varying['op'])
+    if not n:
+        print("Error parsing the following, skipping it.")
+        print(job)
         print(output)
-        print('read_re = %s' % read_re)
-        print(reads)
-        print('write_re = %s' % write_re)
-        print(writes)
-        sys.exit(1)
-
-table = []
-for (path, cache) in caches:
-    ctr_runtime = path.parts[-1]
-    node = path.parts[-2]
-    
+        return False
+
+    table.extend(row, varying, n)
+    return True
+
+def cache_file(folder):
+    path = os.path.join(folder, 'results.log')
+    if not os.path.isfile(path):
+        path = os.path.join(folder, 'cache.pickle')
+    return path
+
+def cache_entries(folder, part=None):
+    """Yield (key, crc, load) for every result in folder.
+
+    Calling load() returns the (job, output) pair; it is only called for
+    entries that have not been parsed before. part is a part of the
+    results.log index (see ResultStore.parts) to yield instead of the whole
+    store.
+    """
+    path = cache_file(folder)
+    if path.endswith('results.log'):
+        store = resultstore.ResultStore(folder, part=part)
+        with open(store.path, 'rb') as f:
+            for key in store.index:
+                yield key, store.crc(key), lambda key=key: store.load(f, key)
+    else:
+        with open(path, 'rb') as f:
+            cache = pickle.load(f)
+        for job, output in cache.items():
+            crc = zlib.crc32(resultstore.output(output).encode('utf-8'))
+            yield jobspec.key(job), crc, lambda job=job, output=output: (job, output)
+
+def parse_chunk(folder, known, part=None):
+    """Parse the results of folder in part, a part of its results.log index.
+
+    Without part every result of folder is parsed. Results whose crc
+    matches the one in known are skipped. Returns the {key: crc} of the
+    chunk and the Columns of the parsed results, with the job key in the
+    '_key' column. Runs in a worker process.
+    """
+    folder = pathlib.Path(folder)
+    ctr_runtime = folder.parts[-1]
+    node = folder.parts[-2]
     common_fields = { 'ctr-runtime' : ctr_runtime, 'node' : node }
-    for job, output in cache.items():
-        add_job_to_table(job, output, common_fields, table)
 
-df = pd.DataFrame(table)
+    crcs = {}
+    columns = Columns()
+    for key, crc, load in cache_entries(folder, part):
+        crcs[key] = crc
+        if known.get(key) == crc:
+            continue
+        job, output = load()
+        common_fields['_key'] = key
+        add_job_to_table(job, output, common_fields, columns)
+    return crcs, columns
+
+# Bumped whenever the parsed columns change so that old manifests are ignored.
+manifest_version = 7
+
+def load_manifest(path):
+    if os.path.isfile(path):
+        with open(path, 'rb') as f:
+            manifest = pickle.load(f)
+        if isinstance(manifest, tuple) and manifest[0] == manifest_version:
+            return manifest[1]
+    return {}
+
+def save_manifest(path, manifest):
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump((manifest_version, manifest), f)
+    os.replace(path + '.tmp', path)
+
+sort_columns = ['ctr-runtime', 'node', 'readwrite', 'op', 'iodepth', 'bs', 'numjobs']
+
+def write_part(columns, path):
+    """Write columns to a CSV file, sorted the same way as data.csv."""
+    keys = [columns.data[c] for c in sort_columns if c in columns.data]
+    order = sorted(range(columns.length), key=lambda i: tuple(str(k[i]) for k in keys))
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(columns.data.keys())
+        for i in order:
+            writer.writerow(['' if v[i] is None else v[i] for v in columns.data.values()])
+
+def read_part(path):
+    columns = Columns()
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        for c in header:
+            columns.column(c)
+        for row in reader:
+            for c, v in zip(header, row):
+                columns.data[c].append(v if v != '' else None)
+            columns.length += 1
+    return columns
+
+def entry_columns(entry):
+    """Return the parsed Columns of a manifest entry, from memory or its part file."""
+    if entry.get('columns') is not None:
+        return entry['columns']
+    if entry.get('part') and os.path.isfile(entry['part']):
+        return read_part(entry['part'])
+    return Columns()
+
+def update(manifest, root='.', workers=None, chunk_size=1000):
+    """Bring manifest up to date with the result caches under root.
+
+    The manifest maps each result folder to the (mtime, size) of its cache
+    file, the crc of every job result keyed by JobSpec digest, and the
+    parsed Columns (or the part file holding them). Folders whose cache
+    file did not change are not opened at all. The index of a changed
+    folder is read once and split into chunks of at most chunk_size jobs
+    that are parsed in a process pool, and within them only new or changed
+    results are parsed.
+
+    Yields (folder, entry) in folder order. Only a bounded number of folders
+    are in flight at a time, so a consumer that does not keep the entries'
+    Columns uses memory proportional to a few cache files.
+    """
+    window = 2 * (workers or os.cpu_count() or 1)
+    pending = collections.deque()
+
+    def finish(folder, stamp, entry, futures):
+        if futures is None:
+            return folder, entry
+        crcs = {}
+        parts = []
+        for f in futures:
+            chunk_crcs, columns = f.result()
+            crcs.update(chunk_crcs)
+            parts.append(columns)
+        if entry:
+            # Keep rows of results that are still present and unchanged.
+            keep = set(k for k, crc in entry['crcs'].items() if crcs.get(k) == crc)
+            parts.insert(0, entry_columns(entry).take('_key', keep))
+        return folder, {'stamp': stamp, 'crcs': crcs, 'columns': Columns.concat(parts)}
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        for folder in resultstore.result_folders(root):
+            path = cache_file(folder)
+            st = os.stat(path)
+            stamp = (st.st_mtime_ns, st.st_size)
+            entry = manifest.get(str(folder))
+            if entry and entry['stamp'] == stamp:
+                pending.append((str(folder), stamp, entry, None))
+            else:
+                print('Parsing %s' % folder)
+                known = entry['crcs'] if entry else {}
+                if path.endswith('results.log'):
+                    # The log is scanned once here; every worker reads only its records.
+                    chunks = resultstore.ResultStore(folder).parts(chunk_size)
+                else:
+                    chunks = [None]
+                pending.append((str(folder), stamp, entry, [
+                    pool.submit(parse_chunk, str(folder), known, chunk)
+                    for chunk in chunks or [([], {})]]))
+
+            while len(pending) > window:
+                yield finish(*pending.popleft())
+
+        while pending:
+            yield finish(*pending.popleft())
+
+def table(manifest):
+    return Columns.concat([entry_columns(manifest[folder]) for folder in sorted(manifest)])
+
+def stream(manifest, output, parts_dir, workers=None, chunk_size=1000):
+    """Convert results one folder at a time and return the updated manifest.
+
+    Each folder's rows are written to a part file in parts_dir as soon as it
+    is parsed, and the manifest only keeps the part file name. The parts are
+    then concatenated into output row by row, so peak memory depends on
+    the largest cache file rather than on the whole data tree.
+    """
+    os.makedirs(parts_dir, exist_ok=True)
+    updated = {}
+    header = {}
+    for folder, entry in update(manifest, '.', workers, chunk_size):
+        if entry.get('columns') is not None:
+            part = os.path.join(parts_dir, hashlib.sha1(folder.encode('utf-8')).hexdigest() + '.csv')
+            write_part(entry['columns'], part)
+            entry = dict(entry, columns=None, part=part, header=list(entry['columns'].data))
+        updated[folder] = entry
+        header.update(dict.fromkeys(entry['header']))
+    header.pop('_key', None)
+
+    with open(output, 'w', newline='') as out:
+        writer = csv.DictWriter(out, list(header), extrasaction='ignore', lineterminator='\n')
+        writer.writeheader()
+        for folder in sorted(updated):
+            with open(updated[folder]['part'], newline='') as f:
+                writer.writerows(csv.DictReader(f))
+    return updated
+
+# Columns that are text even when every value looks like a number.
+text_columns = (histogram.column, 'kata config', 'BW', 'op')
+
+def typed(df):
+    """Return df with numeric columns as numbers and the rest as categoricals.
+
+    Most string columns (node, readwrite, ioengine, ...) repeat a handful of
+    values, so storing them as categoricals lets Parquet dictionary-encode
+    them.
+    """
+    df = df.copy()
+    for c in df.columns:
+        # Histograms are unique per row, so they are not worth a dictionary.
+        if df[c].dtype != object or c == histogram.column:
+            continue
+        if c in text_columns:
+            df[c] = df[c].astype('category')
+            continue
+        try:
+            df[c] = pd.to_numeric(df[c])
+        except (ValueError, TypeError):
+            df[c] = df[c].astype('category')
+    return df
+
+def write_parquet(df, path):
+    if not pyarrow:
+        print('pyarrow is not installed; not writing %s' % path)
+        return
+    typed(df).to_parquet(path, index=False)
+
+def column_kinds(csv_path):
+    """Return {column: 'int', 'float' or 'str'} from every value of a CSV file.
+
+    Reading the file once more is cheap next to parsing the results, and
+    unlike inference from the first block it holds for columns that only
+    have values further down, as those of newer results do.
+    """
+    with open(csv_path, newline='') as f:
+        reader = csv.reader(f)
+        columns = next(reader, [])
+        kinds = ['int'] * len(columns)
+        for row in reader:
+            for i, v in enumerate(row):
+                if not v or kinds[i] == 'str':
+                    continue
+                if kinds[i] == 'int':
+                    try:
+                        int(v)
+                        continue
+                    except ValueError:
+                        kinds[i] = 'float'
+                try:
+                    float(v)
+                except ValueError:
+                    kinds[i] = 'str'
+    return {c: 'str' if c in text_columns else k for c, k in zip(columns, kinds)}
+
+def csv_to_parquet(csv_path, path, block_size=1 << 24):
+    """Convert a CSV file to Parquet one block at a time.
+
+    The type of every column is fixed up front: pyarrow would infer it from
+    the first block, where columns of newer results may still be empty.
+    """
+    if not pyarrow:
+        print('pyarrow is not installed; not writing %s' % path)
+        return
+    types = {'int': pyarrow.int64(), 'float': pyarrow.float64(),
+             'str': pyarrow.dictionary(pyarrow.int32(), pyarrow.string())}
+    column_types = {c: types[k] for c, k in column_kinds(csv_path).items()}
+    # Histograms are unique per row, so they are not worth a dictionary.
+    if histogram.column in column_types:
+        column_types[histogram.column] = pyarrow.string()
+    reader = pyarrow.csv.open_csv(
+        csv_path,
+        read_options=pyarrow.csv.ReadOptions(block_size=block_size),
+        convert_options=pyarrow.csv.ConvertOptions(column_types=column_types))
+    with pyarrow.parquet.ParquetWriter(path, reader.schema) as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert fio results to CSV and Parquet')
+    parser.add_argument('--manifest', type=str, default='tocsv.manifest')
+    parser.add_argument('--full', action='store_const', const=True,
+                        help='Ignore the manifest and reparse every result')
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help='Number of parser processes (default: number of CPUs)')
+    parser.add_argument('--chunk-size', type=int, default=1000,
+                        help='Maximum number of jobs parsed by one worker task')
+    parser.add_argument('--stream', action='store_const', const=True,
+                        help='Convert one cache at a time with bounded memory. '
+                             'The table is not printed.')
+    parser.add_argument('--parts-dir', type=str, default='tocsv.parts',
+                        help='Where --stream keeps converted rows of each cache')
+
+    args = parser.parse_args()
+
+    manifest = {} if args.full else load_manifest(args.manifest)
+
+    if args.stream:
+        manifest = stream(manifest, 'data.csv', args.parts_dir, args.jobs, args.chunk_size)
+        save_manifest(args.manifest, manifest)
+        csv_to_parquet('data.csv', 'data.parquet')
+        sys.exit(0)
+
+    manifest = dict(update(manifest, '.', args.jobs, args.chunk_size))
+    save_manifest(args.manifest, manifest)
+
+    columns = table(manifest).data
+    columns.pop('_key', None)
+    df = pd.DataFrame(columns)
 
-pd.set_option('display.max_rows', None)
-pd.set_option('display.max_columns', None)
-pd.set_option('display.width', 1000)
-pd.set_option('display.colheader_justify', 'center')
-pd.set_option('display.precision', 3)
+    pd.set_option('display.max_rows', None)
+    pd.set_option('display.max_columns', None)
+    pd.set_option('display.width', 1000)
+    pd.set_option('display.colheader_justify', 'center')
+    pd.set_option('display.precision', 3)
 
-df = df.drop_duplicates()
-df = df.sort_values(['ctr-runtime', 'node', 'readwrite', 'op', 'iodepth', 'bs', 'numjobs'])
-print(df)
+    df = df.drop_duplicates()
+    df = df.sort_values(sort_columns)
+    print(df)
 
-df.to_csv('data.csv', index=False)
+    df.to_csv('data.csv', index=False)
+    write_parquet(df, 'data.parquet')